@@ -92,7 +92,7 @@ def main(argv):
         os.makedirs(os.path.dirname(output_path), exist_ok=True)
         with open(output_path, "w", encoding="utf-8") as f:
             for item in data:
-                f.write(json.dumps(item, ensure_ascii=False) + "\n")
+                f.write(json.dumps(dict(item), ensure_ascii=False) + "\n")
 
 if __name__ == "__main__":
     app.run(main)
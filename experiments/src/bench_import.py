@@ -0,0 +1,50 @@
+"""
+Guards the import time of the grammar_v_mtllm package, which every worker process and CLI entry point pays.
+Fails (exit code 1) if importing it loads any heavy dependency or takes longer than the budget.
+
+usage:
+python experiments/src/bench_import.py --budget-ms 50
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+
+HEAVY_MODULES = ["subset2evaluate", "matplotlib", "numpy", "pandas", "torch", "vllm"]
+
+args = argparse.ArgumentParser()
+args.add_argument("--budget-ms", type=float, default=50)
+args.add_argument("--runs", type=int, default=10)
+args = args.parse_args()
+
+failed = False
+for statement in ["import grammar_v_mtllm", "import grammar_v_mtllm.utils", "import grammar_v_mtllm.utils_fig"]:
+    # check that no heavy module is pulled in
+    heavy = subprocess.run(
+        [
+            sys.executable, "-c",
+            f"import sys; {statement}; print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+        ],
+        capture_output=True, text=True, check=True,
+    ).stdout.strip()
+
+    # -X importtime reports cumulative microseconds per module on stderr
+    times = []
+    for _ in range(args.runs):
+        stderr = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", statement],
+            capture_output=True, text=True, check=True,
+        ).stderr
+        times.append(max(
+            int(line.split("|")[1])
+            for line in stderr.splitlines()
+            if line.startswith("import time:") and "grammar_v_mtllm" in line
+        ) / 1000)
+
+    time_ms = statistics.median(times)
+    ok = not heavy and time_ms <= args.budget_ms
+    failed |= not ok
+    print(f"{'OK' if ok else 'FAIL':4} {statement:40} {time_ms:6.1f}ms (budget {args.budget_ms:.0f}ms) heavy modules: {heavy or '-'}")
+
+sys.exit(1 if failed else 0)
@@ -10,8 +10,13 @@ data = grammar_v_mtllm.utils.load_data(split="tiny_test", langs="en-cs")
 assert len(data) == 100
 data = grammar_v_mtllm.utils.load_data(split="tiny_test", langs="all")
 assert len(data) == 1100
+# splits are nested
+assert list(grammar_v_mtllm.utils.load_data(split="test", langs="en-cs")[:100]) == list(grammar_v_mtllm.utils.load_data(split="tiny_test", langs="en-cs"))
+data = grammar_v_mtllm.utils.load_data(split=1000, langs="en-cs")
+assert list(data[:500]) == list(grammar_v_mtllm.utils.load_data(split="test", langs="en-cs"))
 data = grammar_v_mtllm.utils.load_data(langs="three")
 print(len(data))
+assert [x for batch in grammar_v_mtllm.utils.iter_data(langs="three", batch_size=32) for x in batch] == list(data)
 
 # %%
 
@@ -7,6 +7,7 @@ import json
 import os
 import eval_metrics_worker
 import tqdm
+from grammar_v_mtllm import utils_outputs
 
 args = argparse.ArgumentParser()
 args.add_argument("data", nargs="+")
@@ -14,12 +15,16 @@ args = args.parse_args()
 
 for fname in tqdm.tqdm(args.data):
     print(fname)
-    with open(fname, "r") as f:
-        data = [json.loads(x) for x in f]
+    data = utils_outputs.read_outputs(fname)
 
     data = eval_metrics_worker.evaluate_data(data)
 
     foutname = fname.replace('/translated/', '/evaluated/')
+    if utils_outputs.is_partition(fname):
+        # keep the evaluated outputs normalized too
+        utils_outputs.copy_tables(fname, foutname)
+        utils_outputs.write_outputs(foutname, data)
+        continue
     os.makedirs(os.path.dirname(foutname), exist_ok=True)
     with open(foutname, "w") as f:
         f.write("\n".join([json.dumps(x, ensure_ascii=False) for x in data]))
\ No newline at end of file
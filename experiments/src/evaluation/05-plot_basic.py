@@ -5,6 +5,8 @@ import numpy as np
 import collections
 import grammar_v_mtllm.utils_fig
 
+grammar_v_mtllm.utils_fig.set_style()
+
 args = argparse.ArgumentParser()
 args.add_argument("data", nargs="+")
 args = args.parse_args()
@@ -5,6 +5,8 @@ import collections
 import grammar_v_mtllm.utils_fig
 import grammar_v_mtllm.utils
 
+grammar_v_mtllm.utils_fig.set_style()
+
 args = argparse.ArgumentParser()
 args.add_argument("key_y", choices=["langs", "comet", "chrf"])
 args.add_argument("data", nargs="+")
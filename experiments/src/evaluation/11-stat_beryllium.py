@@ -3,16 +3,14 @@ import argparse
 import numpy as np
 import collections
 import sys
+import grammar_v_mtllm.utils
 
 args = argparse.ArgumentParser()
 args.add_argument("data", nargs="+")
 args = args.parse_args()
 
 # load all data from args.dir
-data_all = [
-    [json.loads(x) for x in open(f, "r")]
-    for f in args.data
-]
+data_all = grammar_v_mtllm.utils.load_jsonl_files(args.data)
 
 
 def get_bucket_id(x):
@@ -1,65 +1,476 @@
 # %%
+import glob
+import hashlib
 import json
+import math
 import os
 import sys
+import time
 from argparse import Namespace
 
 import grammar_v_mtllm
-from models import load_model
-from utils import parse_arguments, load_prompts, CODE_MAP
+from grammar_v_mtllm import utils_outputs
+from utils import (
+    parse_arguments, load_prompts, compile_prompt, render_prompt, render_chunks, get_model_short, get_model_type,
+    API_PRICES,
+)
 
 
 # %%
-def main(args=None):
-    if args is None:
-        args = parse_arguments()
+def get_prompt_text_id(args, prompt):
+    prompt_text = prompt['prompt'] if not args.perturbation else prompt['noised_prompt']
+    prompt_id = prompt.get("prompt_id") if not args.perturbation else prompt.get("noised_prompt_id")
+    return prompt_text, prompt_id
 
-    # load data
-    data = grammar_v_mtllm.utils.load_data(split=args.split, langs=f"{args.lp}")
-    # load model
-    model = load_model(args.model, args.gpus, args.mem_percent)
 
-    prompts = load_prompts(args)
+def build_model_inputs(prompt_text, data):
+    return render_prompt(compile_prompt(prompt_text), data)
+
+
+def get_output_path(args, model, prompt_id):
+    dirname = f'../output_translations/wmt24/system-outputs/{model.short}/{args.lp}/{args.split}'
+    if args.output_format == "store":
+        # partition of the outputs table, the items and prompts tables are in `dirname`
+        dirname += "/outputs"
+    return f'{dirname}/noising_{args.perturbation}_{prompt_id}_{args.split}_results.jsonl'
+
+
+def save_translations(args, model, data, prompt, model_inputs, translations, stopped_early, samples):
+    prompt_text, prompt_id = get_prompt_text_id(args, prompt)
+
+    data_translated = [{} for _ in data]
+    for idx, translation in enumerate(translations):
+        data_translated[idx]["src"] = data[idx]["src"]
+        data_translated[idx]["ref"] = data[idx]["ref"]
+        data_translated[idx]["langs"] = data[idx]["langs"]
+        data_translated[idx]['model'] = model.short
+        data_translated[idx]['prompt_src'] = prompt.get("prompt_src")
+        data_translated[idx]['model_input'] = model_inputs[idx]
+        data_translated[idx]['prompt'] = prompt_text
+        data_translated[idx]['prompt_p'] = prompt.get("noise_type_parameters", None)
+        data_translated[idx]['prompt_noiser'] = prompt.get("prompt_noiser", None)
+        data_translated[idx]['bucket_id'] = prompt.get("bucket_id", None)
+        data_translated[idx]['prompt_id'] = prompt_id
+        data_translated[idx]['tgt'] = translation
+        if args.stop_repetitions:
+            data_translated[idx]['stopped_early'] = stopped_early[idx]
+        if args.samples > 1:
+            data_translated[idx]['tgts'] = samples[idx]
+
+    path = get_output_path(args, model, prompt_id)
+    if args.output_format == "store":
+        for idx, item in enumerate(data_translated):
+            item["item_id"] = utils_outputs.get_item_id(data[idx])
+        dirname = utils_outputs.get_store_dir(path)
+        template = compile_prompt(prompt_text)
+        utils_outputs.write_items(dirname, data_translated)
+        utils_outputs.write_prompt(dirname, utils_outputs.get_prompt_key(path), {
+            "prompt_src": prompt.get("prompt_src"),
+            "prompt": prompt_text,
+            "prompt_p": prompt.get("noise_type_parameters", None),
+            "prompt_noiser": prompt.get("prompt_noiser", None),
+            "bucket_id": prompt.get("bucket_id", None),
+            "prompt_id": prompt_id,
+            # the model input of an item is its source text joined with these chunks
+            "input_chunks": {langs: render_chunks(template, langs) for langs in dict.fromkeys(item["langs"] for item in data)},
+        })
+        utils_outputs.write_outputs(path, data_translated)
+        return
+
+    # save data as jsonl
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        for item in data_translated:
+            f.write(json.dumps(item, ensure_ascii=False) + "\n")
+
+
+def is_complete(path, data, model_inputs, samples=1):
+    """Whether `path` is a finished output file for exactly these inputs."""
+    if not os.path.exists(path):
+        return False
+    try:
+        lines = utils_outputs.read_outputs(path)
+    except (json.JSONDecodeError, UnicodeDecodeError, KeyError, FileNotFoundError):
+        return False
+    return len(lines) == len(data) and all(
+        line.get("src") == item["src"] and line.get("model_input") == model_input and "tgt" in line
+        and (samples == 1 or len(line.get("tgts", [])) == samples)
+        for line, item, model_input in zip(lines, data, model_inputs)
+    )
+
+
+def load_checkpoint(path, model_inputs):
+    """Translations, early stop flags and samples restored from the item-level checkpoint of `path`."""
+    translations = [None for _ in model_inputs]
+    stopped_early = [False for _ in model_inputs]
+    samples = [None for _ in model_inputs]
+    if os.path.exists(path + ".partial"):
+        with open(path + ".partial", "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    line = json.loads(line)
+                except json.JSONDecodeError:
+                    # the last line may be cut off when the job was killed
+                    continue
+                if line["idx"] < len(model_inputs) and line["model_input"] == model_inputs[line["idx"]]:
+                    translations[line["idx"]] = line["tgt"]
+                    stopped_early[line["idx"]] = line.get("stopped_early", False)
+                    samples[line["idx"]] = line.get("tgts", [line["tgt"]])
+    return translations, stopped_early, samples
+
+
+def truncate_checkpoint(path):
+    # drop a last line that was cut off when the job was killed, so that new records start on their own line
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        content = f.read()
+        if content and not content.endswith(b"\n"):
+            f.truncate(content.rfind(b"\n") + 1)
+
+
+def get_request_key(model, model_input):
+    """Hash of everything that determines the model output for this input."""
+    return hashlib.sha1(json.dumps(
+        [model.model, model.system_prompt, repr(model.sampling_params), model.stop_repetitions, model_input],
+        ensure_ascii=False,
+    ).encode("utf-8")).hexdigest()
+
+
+def get_metrics_path(path):
+    return path.removesuffix(".jsonl") + ".metrics.json"
+
+
+def get_metrics(stats, latencies, wall_time):
+    """Throughput and latency of the requests counted in `stats` and `latencies`."""
+    latencies = sorted(latencies)
+    tokens = stats["prompt_tokens"] + stats["completion_tokens"]
+    return {
+        "wall_time_s": wall_time,
+        "requests": stats["requests"],
+        "requests_per_s": stats["requests"] / max(wall_time, 1e-9),
+        "prompt_tokens": stats["prompt_tokens"],
+        "completion_tokens": stats["completion_tokens"],
+        "tokens_per_s": tokens / max(wall_time, 1e-9),
+        "completion_tokens_per_s": stats["completion_tokens"] / max(wall_time, 1e-9),
+        # nearest rank, None if the backend does not report request timings
+        "latency_s": {
+            f"p{q}": latencies[max(math.ceil(len(latencies) * q / 100) - 1, 0)] if latencies else None
+            for q in [50, 95, 99]
+        },
+        "retries": stats["retries"],
+        "rate_limited": stats["rate_limited"],
+        "counters": dict(stats),
+    }
+
+
+def get_length_budget(args, model, data, max_files=5):
+    """Length budget for `model`, learned from its last `max_files` outputs for this lp and split."""
+    from models import LengthBudget
+
+    stats = grammar_v_mtllm.utils.load_stats(split=args.split, langs=f"{args.lp}", tokenizers=(model.model,))
+    src_tokens = {(item["langs"], item["src"]): stat["src_tokens"][model.model] for item, stat in zip(data, stats)}
+    budget = LengthBudget(model.get_token_cache(), src_tokens, model.sampling_params.max_tokens, margin=args.length_budget_margin)
+    fnames = sorted(glob.glob(os.path.join(os.path.dirname(get_output_path(args, model, None)), "*.jsonl")), key=os.path.getmtime)
+    for fname in fnames[-max_files:]:
+        rows = [row for row in utils_outputs.read_outputs(fname) if isinstance(row["tgt"], str)]
+        budget.observe(rows, [row["tgt"] for row in rows])
+    return budget
+
+
+def build_jobs(args, model, data):
+    """Prompts of the scenario in `args` that are not done yet, with inputs, output path and checkpoint."""
+    if args.prompt_ids:
+        # for bucketed prompts, pick the requested prompt from each bucket
+        def prefer(prompt):
+            return get_prompt_text_id(args, prompt)[1] in args.prompt_ids
+    elif args.resume:
+        # for bucketed prompts, pick the already (partly) translated prompt from each bucket
+        def prefer(prompt):
+            path = get_output_path(args, model, get_prompt_text_id(args, prompt)[1])
+            return os.path.exists(path) or os.path.exists(path + ".partial")
+    else:
+        prefer = None
+    prompts = load_prompts(args, prefer=prefer)
+    if args.prompt_ids:
+        prompts = [prompt for prompt in prompts if prefer(prompt)]
     if args.rerun_last is not None:
         # rerun the last N experiments
         prompts = prompts[-args.rerun_last:]
-    # run experiments
+
+    jobs = []
     for prompt in prompts:
-        data_translated = [{} for _ in data]
-        prompt_text = prompt['prompt'] if not args.perturbation else prompt['noised_prompt']
-        prompt_id = prompt.get("prompt_id") if not args.perturbation else prompt.get("noised_prompt_id")
-
-        model_inputs = []
-        for item in data:
-            # print(item)
-            model_inputs.extend([prompt_text.replace("{source_lang}", CODE_MAP[item['langs'][:2]]).replace(
-                "{target_lang}", CODE_MAP[item['langs'][3:]]).replace("{source_text}", item['src'])])
-        print("Model inputs are built. Starting generation")
-
-        # generate translations
-        translations = model.generate(model_inputs)
-        # save translations
-        for idx, translation in enumerate(translations):
-            data_translated[idx]["src"] = data[idx]["src"]
-            data_translated[idx]["ref"] = data[idx]["ref"]
-            data_translated[idx]["langs"] = data[idx]["langs"]
-            data_translated[idx]['model'] = model.short
-            data_translated[idx]['prompt_src'] = prompt.get("prompt_src")
-            data_translated[idx]['model_input'] = model_inputs[idx]
-            data_translated[idx]['prompt'] = prompt_text
-            data_translated[idx]['prompt_p'] = prompt.get("noise_type_parameters", None)
-            data_translated[idx]['prompt_noiser'] = prompt.get("prompt_noiser", None)
-            data_translated[idx]['bucket_id'] = prompt.get("bucket_id", None)
-            data_translated[idx]['prompt_id'] = prompt_id
-            data_translated[idx]['tgt'] = translation
-
-        # save data as jsonl
-        os.makedirs(f'../output_translations/wmt24/system-outputs/{model.short}/{args.lp}/{args.split}', exist_ok=True)
-        with open(
-                f'../output_translations/wmt24/system-outputs/{model.short}/{args.lp}/{args.split}/noising_{args.perturbation}_{prompt_id}_{args.split}_results.jsonl',
-                'w', encoding='utf-8') as f:
-            for item in data_translated:
-                f.write(json.dumps(item, ensure_ascii=False) + "\n")
+        job = {
+            "prompt": prompt,
+            "model_inputs": build_model_inputs(get_prompt_text_id(args, prompt)[0], data),
+            "path": get_output_path(args, model, get_prompt_text_id(args, prompt)[1]),
+        }
+        if args.resume and is_complete(job["path"], data, job["model_inputs"], args.samples):
+            print(f"Skipping {job['path']}, already done")
+            continue
+        if args.resume:
+            job["translations"], job["stopped_early"], job["samples"] = load_checkpoint(job["path"], job["model_inputs"])
+        else:
+            job["translations"], job["stopped_early"], job["samples"] = [None for _ in data], [False for _ in data], [None for _ in data]
+        jobs.append(job)
+    return jobs
+
+
+def run_scenario(args, model, data, generated=None, budget=None):
+    """Translate `data` with all prompts of the scenario in `args` and save one output file per prompt."""
+    # request key -> (translation, stopped early, samples), shared between scenarios for deduplication
+    if generated is None:
+        generated = {}
+    jobs = build_jobs(args, model, data)
+    print("Model inputs are built. Starting generation")
+
+    if args.batch_prompts:
+        # submit all prompts x items at once so that the engine is never drained between prompts
+        groups = [jobs] if jobs else []
+    else:
+        groups = [[job] for job in jobs]
+
+    for group in groups:
+        time_start = time.time()
+        # identical requests (e.g. the clean copies of the prompt in orthographic_0.00 or colliding noised prompts)
+        # are generated only once and fanned out to every prompt and item that needs them
+        pending = {}
+        for job in group:
+            for idx, translation in enumerate(job["translations"]):
+                key = get_request_key(model, job["model_inputs"][idx]) if args.dedup else (job["path"], idx)
+                if translation is None:
+                    pending.setdefault(key, []).append((job, idx))
+                else:
+                    generated.setdefault(key, (translation, job["stopped_early"][idx], job["samples"][idx]))
+
+        def fill(key, translation, stopped_early, samples):
+            for job, idx in pending[key]:
+                job["translations"][idx] = translation
+                job["stopped_early"][idx] = stopped_early
+                job["samples"][idx] = samples
+                if args.resume:
+                    with open(job["path"] + ".partial", "a", encoding="utf-8") as f:
+                        f.write(json.dumps(
+                            {"idx": idx, "model_input": job["model_inputs"][idx], "tgt": translation, "stopped_early": stopped_early}
+                            | ({"tgts": samples} if args.samples > 1 else {}),
+                            ensure_ascii=False
+                        ) + "\n")
+
+        if args.resume:
+            os.makedirs(os.path.dirname(group[0]["path"]), exist_ok=True)
+            for job in group:
+                truncate_checkpoint(job["path"] + ".partial")
+        for key in [key for key in pending if key in generated]:
+            fill(key, *generated[key])
+        keys = [key for key in pending if key not in generated]
+        count_pending = sum(len(pending[key]) for key in pending)
+        count_done = len(group) * len(data) - count_pending
+        print(
+            f"Generating {len(keys)} unique of {count_pending} pending inputs "
+            f"(dedup ratio {count_pending / max(len(keys), 1):.2f}x, {count_done} restored from checkpoints)"
+        )
+
+        if args.prefix_order:
+            # sorting the inputs puts requests that share a (noised) instruction prefix next to each other, so that
+            # vLLM's prefix cache can reuse their KV blocks
+            keys.sort(key=lambda key: pending[key][0][0]["model_inputs"][pending[key][0][1]])
+        stats_before = model.stats.copy()
+        count_latencies = len(model.latencies)
+
+        # with --resume, generate in chunks and checkpoint each item so that only missing items are ever regenerated;
+        # only API models are chunked by default, a chunk is a barrier that would drain the batches of a local engine
+        checkpoint_every = args.checkpoint_every or (100 if model.type == "openai" else None)
+        chunk_size = checkpoint_every if args.resume and checkpoint_every else max(len(keys), 1)
+        for chunk_start in range(0, len(keys), chunk_size):
+            chunk = keys[chunk_start:chunk_start + chunk_size]
+            # generate translations
+            model_inputs = [pending[key][0][0]["model_inputs"][pending[key][0][1]] for key in chunk]
+            if budget is not None:
+                items = [data[pending[key][0][1]] for key in chunk]
+                translations = model.generate(model_inputs, max_tokens=budget.predict(items))
+                budget.observe(items, translations)
+            else:
+                translations = model.generate(model_inputs)
+            # only set by vLLM models with --stop-repetitions
+            stopped_early = model.last_stopped_early if len(model.last_stopped_early) == len(chunk) else [False for _ in chunk]
+            samples = model.last_samples if len(model.last_samples) == len(chunk) else [[translation] for translation in translations]
+            for key, translation, stopped, samples_key in zip(chunk, translations, stopped_early, samples):
+                generated[key] = (translation, stopped, samples_key)
+                fill(key, translation, stopped, samples_key)
+
+        stats = model.stats - stats_before
+        if args.prefix_order and keys:
+            print(
+                f"Prefix cache hit rate {stats['cached_prompt_tokens'] / max(stats['prompt_tokens'], 1):.1%}, "
+                f"{stats['cached_prompt_tokens']} of {stats['prompt_tokens']} prefill tokens saved"
+            )
+        if budget is not None and keys:
+            max_tokens_flat = len(keys) * model.sampling_params.max_tokens
+            print(
+                f"Length budget reserved {stats['max_tokens_reserved']} of {max_tokens_flat} max tokens "
+                f"({stats['max_tokens_reserved'] / max_tokens_flat:.1%}), {stats['truncated_reruns']} truncated "
+                f"outputs generated again"
+            )
+        if args.stop_repetitions and keys:
+            print(
+                f"Stopped {stats['stopped_early']} looping generations early, "
+                f"{stats['stopped_early_saved_tokens']} decoding tokens saved"
+            )
+
+        for job in group:
+            save_translations(
+                args, model, data, job["prompt"], job["model_inputs"], job["translations"], job["stopped_early"], job["samples"]
+            )
+            if os.path.exists(job["path"] + ".partial"):
+                os.remove(job["path"] + ".partial")
+
+        # with --batch-prompts, the prompts of the group share these numbers
+        metrics = {
+            "model": model.model,
+            "backend": type(model).__name__,
+            "lp": args.lp,
+            "split": args.split,
+            "prompts_in_group": len(group),
+            "data_parallel": args.data_parallel,
+            "inputs": len(group) * len(data),
+            "inputs_unique": len(keys),
+            "inputs_restored": count_done,
+        } | get_metrics(stats, model.latencies[count_latencies:], time.time() - time_start)
+        print(
+            f"{metrics['requests']} requests in {metrics['wall_time_s']:.1f}s ({metrics['requests_per_s']:.2f} req/s, "
+            f"{metrics['tokens_per_s']:.0f} tokens/s), {metrics['retries']} retries, {metrics['rate_limited']} rate limited"
+        )
+        for job in group:
+            with open(get_metrics_path(job["path"]), "w", encoding="utf-8") as f:
+                json.dump({"prompt_id": get_prompt_text_id(args, job["prompt"])[1]} | metrics, f, indent=2)
+
+
+def load_model_for_args(args):
+    # vLLM and the API clients are only imported when a model is needed, e.g. not for --plan
+    from models import load_model, default_sampling_params
+
+    sampling_params = default_sampling_params(
+        n=args.samples, **({"temperature": args.temperature} if args.temperature is not None else {})
+    )
+    return load_model(
+        args.model, args.gpus, args.mem_percent, sampling_params,
+        enable_prefix_caching=args.prefix_order, pretokenize=args.pretokenize, stop_repetitions=args.stop_repetitions,
+        data_parallel=args.data_parallel,
+    )
+
+
+def get_recorded_throughput(model_name):
+    """Requests per second of `model_name` in the metrics files of its previous runs."""
+    requests, wall_time = 0, 0
+    for fname in glob.glob(f'../output_translations/wmt24/system-outputs/{get_model_short(model_name)}/**/*.metrics.json', recursive=True):
+        with open(fname, "r", encoding="utf-8") as f:
+            metrics = json.load(f)
+        # models of different sizes share the short name
+        if metrics["model"] == model_name:
+            requests += metrics["requests"]
+            wall_time += metrics["wall_time_s"]
+    return requests / wall_time if requests and wall_time else None
+
+
+def get_token_lengths(model_name):
+    """Token length function for `model_name` (~4 characters per token without a local tokenizer)."""
+    if get_model_type(model_name) == "vllm":
+        try:
+            import transformers
+            tokenizer = transformers.AutoTokenizer.from_pretrained(model_name, local_files_only=True)
+            return lambda texts: [len(ids) for ids in tokenizer(list(texts), add_special_tokens=False)["input_ids"]], True
+        except (ImportError, OSError, ValueError):
+            pass
+    return lambda texts: [math.ceil(len(text) / 4) for text in texts], False
+
+
+def plan(args):
+    """Print what running `args` would generate and cost, without loading the model."""
+    data = grammar_v_mtllm.utils.load_data(split=args.split, langs=f"{args.lp}")
+    # stand-in for the model, only its name is needed for the output paths
+    model = Namespace(model=args.model, short=get_model_short(args.model))
+
+    inputs = []
+    inputs_by_prompt = {}
+    for prompt, perturbation in args.scenarios or [(args.prompt, args.perturbation)]:
+        args_scenario = Namespace(**(vars(args) | {"prompt": prompt, "perturbation": perturbation}))
+        count_before = len(inputs)
+        for job in build_jobs(args_scenario, model, data):
+            prompt_id = get_prompt_text_id(args_scenario, job["prompt"])[1]
+            for idx, translation in enumerate(job["translations"]):
+                if translation is None:
+                    inputs.append({
+                        "prompt": prompt, "perturbation": perturbation, "prompt_id": prompt_id, "idx": idx,
+                        "langs": data[idx]["langs"], "model_input": job["model_inputs"][idx],
+                    })
+            inputs_by_prompt.setdefault(tuple(job["model_inputs"]), []).append(f"{prompt}:{perturbation}:{prompt_id}")
+        print(f"Scenario {prompt}:{perturbation}: {len(inputs) - count_before} inputs to generate")
+
+    # inputs that are identical to an earlier one are generated only once (unless --no-dedup)
+    seen = set()
+    for line in inputs:
+        line["duplicate"] = line["model_input"] in seen
+        seen.add(line["model_input"])
+    requests = [line for line in inputs if not (args.dedup and line["duplicate"])]
+
+    token_lengths, exact = get_token_lengths(args.model)
+    prompt_tokens = sum(token_lengths([line["model_input"] for line in requests]))
+    ref_tokens = token_lengths([item["ref"] for item in data])
+    completion_tokens = args.samples * sum(ref_tokens[line["idx"]] for line in requests)
+
+    print(f"Plan for {args.model} ({get_model_type(args.model)}) on {args.lp}/{args.split}:")
+    print(
+        f"  {len(inputs)} inputs, {len(inputs) - len(seen)} deduplicable, {len(requests)} requests"
+        f"{'' if args.dedup else ' (--no-dedup)'}"
+    )
+    for prompt_ids in inputs_by_prompt.values():
+        if len(prompt_ids) > 1:
+            print(f"  identical inputs for all items: {', '.join(prompt_ids)}")
+    print(
+        f"  {prompt_tokens} prompt tokens and ~{completion_tokens} completion tokens "
+        f"({'exact tokenizer' if exact else 'estimated at 4 characters per token'}, without the chat template)"
+    )
+    prices = [API_PRICES[key] for key in sorted(API_PRICES, key=len, reverse=True) if args.model.startswith(key)]
+    if prices:
+        print(f"  API cost ~${(prompt_tokens * prices[0][0] + completion_tokens * prices[0][1]) / 1e6:.2f}")
+    throughput = get_recorded_throughput(args.model)
+    if throughput:
+        print(f"  wall time ~{len(requests) / throughput / 60:.1f} min at the recorded {throughput:.2f} requests/s")
+    else:
+        print("  wall time unknown, no recorded throughput of this model")
+
+    if args.plan_file:
+        with open(args.plan_file, "w", encoding="utf-8") as f:
+            for line in inputs:
+                f.write(json.dumps(line, ensure_ascii=False) + "\n")
+
+
+def main(args=None, model=None):
+    """Run the scenarios in `args`. An already loaded `model` for `args.model` can be passed to reuse it."""
+    if args is None:
+        args = parse_arguments()
+
+    if args.plan:
+        plan(args)
+        return
+
+    # load data
+    data = grammar_v_mtllm.utils.load_data(split=args.split, langs=f"{args.lp}")
+    # load model once for all scenarios
+    if model is None:
+        model = load_model_for_args(args)
+    # the budget is only meaningful for the KV cache reservation of local models
+    budget = get_length_budget(args, model, data) if args.length_budget and model.type == "vllm" else None
+
+    if not args.scenarios:
+        run_scenario(args, model, data, budget=budget)
+        return
+
+    # deduplicate identical requests across scenarios too
+    generated = {}
+    for prompt, perturbation in args.scenarios:
+        print(f"Scenario: --prompt {prompt} --perturbation {perturbation}")
+        run_scenario(Namespace(**(vars(args) | {"prompt": prompt, "perturbation": perturbation})), model, data, generated, budget)
 
 
 # %%
@@ -78,13 +489,33 @@ if __name__ == "__main__":
             prompt='base',
             split='micro_test',
             gpus=1,
-            perturbation="character_noise"
+            mem_percent=0.9,
+            perturbation="character_noise",
+            prompt_ids=None,
+            plan=False,
+            plan_file=None,
+            rerun_last=None,
+            batch_prompts=False,
+            scenarios=None,
+            resume=False,
+            checkpoint_every=None,
+            dedup=True,
+            prefix_order=False,
+            pretokenize=False,
+            stop_repetitions=False,
+            samples=1,
+            temperature=None,
+            data_parallel=1,
+            length_budget=False,
+            length_budget_margin=1.25,
+            output_format="jsonl",
         )
 
     main(args)
 
 # usage:
 # python -m main --lp cs-uk --model Unbabel/TowerInstruct-7B-v0.2 --prompt base --split micro_test
+# python -m main --model Unbabel/TowerInstruct-7B-v0.2 --split test --scenarios base minimal base:orthographic base:llm
 
 ### working models:
 # Unbabel/TowerInstruct-7B-v0.2
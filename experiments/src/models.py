@@ -1,40 +1,306 @@
 import os
 import sys
+import math
 import time
+import array
+import hashlib
+import sqlite3
+import getpass
+import tempfile
+import queue
+import traceback
+import weakref
+import multiprocessing
+from collections import Counter, defaultdict
 from typing import List, Dict, Any
 from openai import OpenAI
 from anthropic import Anthropic, AnthropicVertex
+import anthropic
 from dotenv import load_dotenv
 import openai
 from vllm import LLM, SamplingParams
+try:
+    # the V1 engine takes custom logits processors only at load time (vLLM >= 0.11)
+    from vllm.v1.sample.logits_processor import AdapterLogitsProcessor
+except ImportError:
+    AdapterLogitsProcessor = None
 from tqdm import tqdm
 import httpx
 from google import genai
 from google.genai.types import HttpOptions, GenerateContentConfig
 import google.genai.errors
+from utils import get_model_short, get_model_type
+
+
+class TokenCache:
+    """Token ids of texts for one tokenizer, cached across runs in an SQLite file on node-local storage."""
+
+    def __init__(self, tokenizer, name: str):
+        self.tokenizer = tokenizer
+        # not under GRAMMAR_V_MTLLM_CACHE, SQLite locking is unreliable on shared filesystems
+        root = os.environ.get(
+            "GRAMMAR_V_MTLLM_TOKEN_CACHE",
+            os.path.join(tempfile.gettempdir(), f"grammar_v_mtllm-{getpass.getuser()}", "tokens"),
+        )
+        path = os.path.join(root, name.replace("/", "--") + ".sqlite")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=600)
+        self.db.execute("CREATE TABLE IF NOT EXISTS tokens (hash TEXT PRIMARY KEY, ids BLOB)")
+
+    def encode(self, texts: list[str]) -> list[list[int]]:
+        hashes = [hashlib.sha1(text.encode("utf-8")).hexdigest() for text in texts]
+        found = {}
+        hashes_unique = list(dict.fromkeys(hashes))
+        for i in range(0, len(hashes_unique), 500):
+            batch = hashes_unique[i:i + 500]
+            for text_hash, ids in self.db.execute(
+                f"SELECT hash, ids FROM tokens WHERE hash IN ({','.join('?' * len(batch))})", batch
+            ):
+                found[text_hash] = array.array("I", ids).tolist()
+
+        missing = {text_hash: text for text_hash, text in zip(hashes, texts) if text_hash not in found}
+        if missing:
+            ids_missing = self.tokenizer(list(missing.values()), add_special_tokens=False)["input_ids"]
+            found.update(zip(missing.keys(), ids_missing))
+            self.db.executemany(
+                "INSERT OR IGNORE INTO tokens VALUES (?, ?)",
+                [(text_hash, array.array("I", ids).tobytes()) for text_hash, ids in zip(missing.keys(), ids_missing)],
+            )
+            self.db.commit()
+
+        return [found[text_hash] for text_hash in hashes]
+
+
+class LengthBudget:
+    """Per-request cap on generated tokens from the source length and the output/source ratios seen per pair."""
+
+    def __init__(self, token_cache: TokenCache, src_tokens: dict[tuple[str, str], int], max_tokens: int, margin: float = 1.25, quantile: float = 0.99, min_samples: int = 50, min_tokens: int = 16):
+        self.token_cache = token_cache
+        # token length of each source text by (langs, src), from the cached corpus statistics
+        self.src_tokens = src_tokens
+        self.max_tokens = max_tokens
+        self.margin = margin
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.min_tokens = min_tokens
+        self.ratios = defaultdict(list)
+        self._ratio = {}
+
+    def observe(self, items: list[dict], tgts: list[str]):
+        for item, ids in zip(items, self.token_cache.encode(tgts)):
+            len_src = self.src_tokens.get((item["langs"], item["src"]))
+            if len_src is None:
+                continue
+            self.ratios[item["langs"]].append(len(ids) / max(len_src, 1))
+            self._ratio.pop(item["langs"], None)
+
+    def ratio(self, lp: str) -> float | None:
+        if lp not in self._ratio:
+            ratios = sorted(self.ratios[lp])
+            self._ratio[lp] = ratios[min(int(self.quantile * len(ratios)), len(ratios) - 1)] if len(ratios) >= self.min_samples else None
+        return self._ratio[lp]
+
+    def predict(self, items: list[dict]) -> list[int]:
+        lengths = [self.src_tokens.get((item["langs"], item["src"])) for item in items]
+        return [
+            self.max_tokens if self.ratio(item["langs"]) is None or len_src is None
+            else min(self.max_tokens, max(self.min_tokens, math.ceil(self.ratio(item["langs"]) * len_src * self.margin)))
+            for item, len_src in zip(items, lengths)
+        ]
+
+
+class RepetitionStopper:
+    """Logits processor that forces EOS once the last tokens repeat one n-gram, checked every `check_every` tokens."""
+
+    def __init__(self, eos_token_id: int, max_period: int = 32, min_repeats: int = 4, min_span: int = 32, check_every: int = 4):
+        self.eos_token_id = eos_token_id
+        self.max_period = max_period
+        self.min_repeats = min_repeats
+        self.min_span = min_span
+        self.check_every = check_every
+
+    def is_looping(self, token_ids) -> bool:
+        token_ids = list(token_ids)
+        if token_ids and token_ids[-1] == self.eos_token_id:
+            token_ids = token_ids[:-1]
+        for period in range(1, self.max_period + 1):
+            span = period * max(self.min_repeats, math.ceil(self.min_span / period))
+            if len(token_ids) >= span and token_ids[-span:] == token_ids[-period:] * (span // period):
+                return True
+        return False
+
+    def __call__(self, token_ids, logits):
+        if len(token_ids) % self.check_every == 0 and self.is_looping(token_ids):
+            logits[:] = float("-inf")
+            logits[self.eos_token_id] = 0
+        return logits
+
+
+if AdapterLogitsProcessor is not None:
+    class RepetitionStopperProcessor(AdapterLogitsProcessor):
+        """Applies a RepetitionStopper to each request whose `SamplingParams.extra_args` set its EOS token id."""
+
+        def is_argmax_invariant(self) -> bool:
+            return False
+
+        def new_req_logits_processor(self, params: SamplingParams) -> RepetitionStopper | None:
+            eos_token_id = (params.extra_args or {}).get("stop_repetitions_eos_token_id")
+            return None if eos_token_id is None else RepetitionStopper(eos_token_id)
+
 
 class Model:
-    def __init__(self, model: str, gpus: int, mem_percent: float, sampling_params: SamplingParams, system_prompt: str):
+    # whether the vLLM engine of a local model is loaded in this process (DataParallelModel loads it in its workers)
+    loads_engine = True
+
+    def __init__(self, model: str, gpus: int, mem_percent: float, sampling_params: SamplingParams, system_prompt: str, enable_prefix_caching: bool = False, pretokenize: bool = False, stop_repetitions: bool = False):
         self.model = model
         self.gpus = gpus
         self.sampling_params = sampling_params
         self.system_prompt = system_prompt
+        self.pretokenize = pretokenize
+        self.stop_repetitions = stop_repetitions
+        # for each output of the last generate call, whether it was stopped early because it looped
+        self.last_stopped_early = []
+        # for each output of the last generate call, all its `sampling_params.n` samples (the output is the first)
+        self.last_samples = []
+        self._token_cache = None
+        self._chat_template_parts = {}
+
+        self.short = get_model_short(model)
+        self.type = get_model_type(model)
+
+        # counters over the lifetime of the model, e.g. prompt tokens served from the vLLM prefix cache
+        self.stats = Counter()
+        # seconds from submission to completion of each request, if the backend reports it
+        self.latencies = []
 
-        self.short = model.split("/")[1].split("-")[0] if "/" in model else model.split("-")[0]
-        self.type = "vllm" if "/" in model else "openai"
+        if self.type == "vllm" and stop_repetitions and AdapterLogitsProcessor is None:
+            raise RuntimeError("--stop-repetitions needs vLLM >= 0.11, whose V1 engine supports custom logits processors")
 
         self.llm: LLM | Anthropic | OpenAI | genai.Client = None
-        if self.type == "vllm":
-            self.llm = LLM(model=model, tensor_parallel_size=gpus, gpu_memory_utilization=mem_percent)
+        if self.type == "vllm" and self.loads_engine:
+            self.llm = LLM(
+                model=model,
+                tensor_parallel_size=gpus,
+                gpu_memory_utilization=mem_percent,
+                # otherwise keep the vLLM default
+                **({"enable_prefix_caching": True} if enable_prefix_caching else {}),
+                **({"logits_processors": [RepetitionStopperProcessor]} if stop_repetitions else {}),
+            )
 
     def __call__(self, prompts: List[str]) -> List[str]:
         return self.generate(prompts)
 
-    def generate(self, model_inputs: list[str], *, quiet: bool = False) -> list[str]:
+    def generate(self, model_inputs: list[str], *, quiet: bool = False, max_tokens: list[int] | None = None) -> list[str]:
         raise NotImplementedError()
 
+    def get_tokenizer(self):
+        return self.llm.get_tokenizer()
+
+    def get_token_cache(self) -> TokenCache:
+        if self._token_cache is None:
+            self._token_cache = TokenCache(self.get_tokenizer(), self.model)
+        return self._token_cache
+
+    def _record_request(self, latency: float | None, prompt_tokens: int | None, completion_tokens: int | None):
+        self.stats["requests"] += 1
+        self.stats["prompt_tokens"] += prompt_tokens or 0
+        self.stats["completion_tokens"] += completion_tokens or 0
+        if latency is not None:
+            self.latencies.append(latency)
+
+    def _retry(self, message: str, seconds: float, rate_limited: bool = False):
+        print(f"\n{message}\n", file=sys.stderr)
+        self.stats["retries"] += 1
+        self.stats["rate_limited"] += rate_limited
+        time.sleep(seconds)
+
+    def _chat_vllm(self, conversations: list[list[dict]], *, quiet: bool = False, max_tokens: list[int] | None = None) -> list[str]:
+        """Generate one response per conversation, rerunning those cut off by a `max_tokens` cap with twice it."""
+        prompts = self._pretokenized(conversations) if self.pretokenize else None
+        caps = [self.sampling_params.max_tokens for _ in conversations] if max_tokens is None else list(max_tokens)
+        texts = [None for _ in conversations]
+        samples = [None for _ in conversations]
+        self.last_stopped_early = [False for _ in conversations]
+        base_params = self.sampling_params
+        if self.stop_repetitions:
+            stopper = RepetitionStopper(self.llm.get_tokenizer().eos_token_id)
+            base_params = self.sampling_params.clone()
+            # enables the RepetitionStopperProcessor of the engine for these requests
+            base_params.extra_args = {**(base_params.extra_args or {}), "stop_repetitions_eos_token_id": stopper.eos_token_id}
+        todo = list(range(len(conversations)))
+        while todo:
+            if max_tokens is None:
+                sampling_params = base_params
+            else:
+                sampling_params = [base_params.clone() for _ in todo]
+                for params, i in zip(sampling_params, todo):
+                    params.max_tokens = caps[i]
+            if prompts is not None:
+                responses = self.llm.generate([prompts[i] for i in todo], sampling_params=sampling_params, use_tqdm=not quiet)
+            else:
+                responses = self.llm.chat(messages=[conversations[i] for i in todo], sampling_params=sampling_params, use_tqdm=not quiet)
+
+            rerun = []
+            for i, response in zip(todo, responses):
+                # request timings are only reported by some vLLM engine versions
+                metrics = getattr(response, "metrics", None)
+                self._record_request(
+                    metrics.finished_time - metrics.arrival_time if getattr(metrics, "finished_time", None) else None,
+                    len(response.prompt_token_ids or []),
+                    sum(len(output.token_ids) for output in response.outputs),
+                )
+                # only reported by vLLM when prefix caching is enabled
+                self.stats["cached_prompt_tokens"] += getattr(response, "num_cached_tokens", None) or 0
+                self.stats["max_tokens_reserved"] += caps[i] * len(response.outputs)
+                # the n samples of a conversation are decoded from one shared prefill, the first one is returned
+                samples[i] = [output.text.strip().replace('\n', ' ').replace('\t', ' ') for output in response.outputs]
+                texts[i] = samples[i][0]
+                looping = [
+                    output for output in response.outputs
+                    if self.stop_repetitions and output.finish_reason == "stop" and stopper.is_looping(output.token_ids)
+                ]
+                self.last_stopped_early[i] = bool(looping)
+                self.stats["stopped_early"] += len(looping)
+                # a looping generation would otherwise run until its cap
+                self.stats["stopped_early_saved_tokens"] += sum(max(caps[i] - len(output.token_ids), 0) for output in looping)
+                if any(output.finish_reason == "length" for output in response.outputs) and caps[i] < self.sampling_params.max_tokens:
+                    caps[i] = min(2 * caps[i], self.sampling_params.max_tokens)
+                    rerun.append(i)
+            self.stats["truncated_reruns"] += len(rerun)
+            todo = rerun
+        self.last_samples = samples
+        return texts
+
+    def _pretokenized(self, conversations: list[list[dict]]) -> list[dict] | None:
+        """Token ids of the conversations for `llm.generate`, or None if the chat template can not be pre-rendered."""
+        tokenizer = self.llm.get_tokenizer()
+
+        texts = []
+        for conversation in conversations:
+            context = tuple((message["role"], message["content"]) for message in conversation[:-1])
+            if context not in self._chat_template_parts:
+                placeholder = "<<<USER_MESSAGE>>>"
+                rendered = tokenizer.apply_chat_template(
+                    list(conversation[:-1]) + [{"role": "user", "content": placeholder}],
+                    tokenize=False, add_generation_prompt=True,
+                ).split(placeholder)
+                # make sure that the template only wraps the message, otherwise use the regular chat path
+                if len(rendered) != 2 or tokenizer.apply_chat_template(
+                    conversation, tokenize=False, add_generation_prompt=True
+                ) != rendered[0] + conversation[-1]["content"] + rendered[1]:
+                    print("\nChat template can not be pre-rendered, falling back to llm.chat\n", file=sys.stderr)
+                    self.pretokenize = False
+                    return None
+                self._chat_template_parts[context] = rendered
+            prefix, suffix = self._chat_template_parts[context]
+            # tokenized as a whole, tokenizers merge across the boundary of the instruction and the source text
+            texts.append(prefix + conversation[-1]["content"] + suffix)
+
+        return [{"prompt_token_ids": ids} for ids in self.get_token_cache().encode(texts)]
+
 class EuroLLMModel(Model):
-    def generate(self, prompts: list[str], *, quiet: bool = False) -> list[str]:
+    def generate(self, prompts: list[str], *, quiet: bool = False, max_tokens: list[int] | None = None) -> list[str]:
         system = {
             "role": "system",
             "content": self.system_prompt
@@ -43,11 +309,10 @@ class EuroLLMModel(Model):
             [system, {"role": "user", "content": prompt}]
             for prompt in prompts
         ]
-        responses = self.llm.chat(messages=conversations, sampling_params=self.sampling_params)        
-        return [response.outputs[0].text.strip().replace('\n', ' ').replace('\t', ' ') for response in responses]
+        return self._chat_vllm(conversations, quiet=quiet, max_tokens=max_tokens)
 
 class QwenLLMModel(Model):
-    def generate(self, prompts: list[str], *, quiet: bool = False) -> list[str]:
+    def generate(self, prompts: list[str], *, quiet: bool = False, max_tokens: list[int] | None = None) -> list[str]:
         system = {
             "role": "system",
             "content": self.system_prompt
@@ -56,18 +321,16 @@ class QwenLLMModel(Model):
             [system, {"role": "user", "content": prompt}]
             for prompt in prompts
         ]
-        responses = self.llm.chat(messages=conversations, sampling_params=self.sampling_params)        
-        return [response.outputs[0].text.strip().replace('\n', ' ').replace('\t', ' ') for response in responses]
+        return self._chat_vllm(conversations, quiet=quiet, max_tokens=max_tokens)
 
 class TowerModel(Model):
-    def generate(self, prompts: list[str], *, quiet: bool = False) -> list[str]:        
+    def generate(self, prompts: list[str], *, quiet: bool = False, max_tokens: list[int] | None = None) -> list[str]:        
         # In the documentation from HF they don't use the system prompt
         conversations = [
             [{"role": "user", "content": prompt}]
             for prompt in prompts
         ]
-        responses = self.llm.chat(messages=conversations, sampling_params=self.sampling_params)        
-        return [response.outputs[0].text.strip().replace('\n', ' ').replace('\t', ' ') for response in responses]
+        return self._chat_vllm(conversations, quiet=quiet, max_tokens=max_tokens)
 
 class AnthropicModel(Model):
     def __init__(self, model: str, gpus: int, sampling_params: SamplingParams, system_prompt: str) -> None:
@@ -92,7 +355,8 @@ class AnthropicModel(Model):
         self.llm = AnthropicVertex(
             region=os.environ["LOCATION"], 
             project_id=os.environ["PROJECT_ID"],
-            max_retries=10,
+            # retried in generate, so that retries and rate limits are counted
+            max_retries=0,
             timeout=httpx.Timeout(300, connect=300, read=300, write=300),
         )
 
@@ -103,27 +367,49 @@ class AnthropicModel(Model):
             for prompt in prompts
         ]
         # TODO add top_p and top_k if used
-        responses = [
-            self.llm.messages.create(
-                model=self.model,
-                max_tokens=self.sampling_params.max_tokens,
-                temperature=self.sampling_params.temperature,
-                system=self.system_prompt,
-                messages=conversation,
-                stop_sequences=self.sampling_params.stop,                
-            ) 
-            for conversation in tqdm(conversations, disable=quiet)
-        ]
+        responses = []
+        for conversation in tqdm(conversations, disable=quiet):
+            # the Messages API has no n parameter, so every sample is a separate request
+            samples = []
+            for _ in range(self.sampling_params.n):
+                ok = False
+                while not ok:
+                    try:
+                        time_start = time.time()
+                        response = self.llm.messages.create(
+                            model=self.model,
+                            max_tokens=self.sampling_params.max_tokens,
+                            temperature=self.sampling_params.temperature,
+                            system=self.system_prompt,
+                            messages=conversation,
+                            stop_sequences=self.sampling_params.stop,                
+                        )
+                        self._record_request(time.time() - time_start, response.usage.input_tokens, response.usage.output_tokens)
+                        samples.append(response)
+                        ok = True
+                    except anthropic.RateLimitError:
+                        self._retry("anthropic.RateLimitError, retry", 30, rate_limited=True)
+                    except anthropic.InternalServerError:
+                        # also 529 overloaded
+                        self._retry("anthropic.InternalServerError, retry", 60)
+                    except anthropic.APIConnectionError:
+                        # also timeouts
+                        self._retry("anthropic.APIConnectionError, retry", 60)
+            responses.append(samples)
         # TODO check if this is correct
-        responses = [response.content[0].text.replace('\n', ' ').replace('\t', ' ') for response in responses]
-        return responses
+        self.last_samples = [
+            [response.content[0].text.replace('\n', ' ').replace('\t', ' ') for response in samples]
+            for samples in responses
+        ]
+        return [samples[0] for samples in self.last_samples]
     
 
 class OpenAIModel(Model):
     def __init__(self, model: str, gpus: int, sampling_params: SamplingParams, system_prompt: str) -> None:
         super().__init__(model, gpus, 1, sampling_params, system_prompt)
         load_dotenv()
-        self.llm = OpenAI()
+        # retried in generate, so that retries and rate limits are counted
+        self.llm = OpenAI(max_retries=0)
 
     def generate(self, prompts: list[str], *, quiet: bool = False) -> list[str]:
         # Gpt-4o: role "developer" is converted to "system"
@@ -134,10 +420,12 @@ class OpenAIModel(Model):
             for prompt in prompts
         ]
         responses = []
+        self.last_samples = []
         for conversation in tqdm(conversations, disable=quiet):
             ok = False
             while not ok:
                 try:
+                    time_start = time.time()
                     response = self.llm.chat.completions.create(
                         model=self.model,
                         messages=conversation,
@@ -147,14 +435,27 @@ class OpenAIModel(Model):
                         seed=self.sampling_params.seed,
                         stop=self.sampling_params.stop
                     )
-                    responses.append(response.choices[0].message.content.replace('\n', ' ').replace('\t', ' '))
+                    self._record_request(
+                        time.time() - time_start,
+                        response.usage.prompt_tokens if response.usage else None,
+                        response.usage.completion_tokens if response.usage else None,
+                    )
+                    # the n choices share one request
+                    samples = [choice.message.content.replace('\n', ' ').replace('\t', ' ') for choice in response.choices]
+                    self.last_samples.append(samples)
+                    responses.append(samples[0])
                     ok = True
                 except openai.NotFoundError:                                        
-                    print("\nopenai.NotFoundError, retry\n", file=sys.stderr)
-                    time.sleep(60)
+                    self._retry("openai.NotFoundError, retry", 60)
                 except openai.PermissionDeniedError:
-                    print("\nopenai.PermissionDeniedError, retry\n", file=sys.stderr)
-                    time.sleep(60)
+                    self._retry("openai.PermissionDeniedError, retry", 60)
+                except openai.RateLimitError:
+                    self._retry("openai.RateLimitError, retry", 30, rate_limited=True)
+                except openai.InternalServerError:
+                    self._retry("openai.InternalServerError, retry", 60)
+                except openai.APIConnectionError:
+                    # also timeouts
+                    self._retry("openai.APIConnectionError, retry", 60)
 
         
 
@@ -175,6 +476,7 @@ class GeminiModel(Model):
             ok = False
             while not ok:
                 try:
+                    time_start = time.time()
                     response = self.llm.models.generate_content(
                         # model="gemini-2.0-flash-001",
                         model=self.model,
@@ -185,55 +487,223 @@ class GeminiModel(Model):
                             temperature=self.sampling_params.temperature,
                             stop_sequences=self.sampling_params.stop,
                             seed=self.sampling_params.seed,
+                            candidate_count=self.sampling_params.n,
                         )
                     )
+                    usage = response.usage_metadata
+                    self._record_request(
+                        time.time() - time_start,
+                        usage.prompt_token_count if usage else None,
+                        usage.candidates_token_count if usage else None,
+                    )
                     responses.append(response)
                     ok = True
                 except google.genai.errors.ClientError as re:
                     if re.code == 429:
-                        print("\nResourceExhausted exception occurred\n", file=sys.stderr)
-                        time.sleep(30)
+                        self._retry("ResourceExhausted exception occurred", 30, rate_limited=True)
                     else:
                         raise re
                 except google.genai.errors.ServerError as se:
                     if se.code == 503:
-                        print("\nService unavailable\n", file=sys.stderr)
-                        time.sleep(60)
+                        self._retry("Service unavailable", 60)
                     elif se.code == 500:
-                        print("\nInternal server error\n", file=sys.stderr)
-                        time.sleep(60)
+                        self._retry("Internal server error", 60)
                     else:
                         raise se
 
+        # response.text is the text of the first candidate
+        self.last_samples = [
+            [response.text] if self.sampling_params.n == 1
+            else ["".join(part.text or "" for part in candidate.content.parts) for candidate in response.candidates]
+            for response in responses
+        ]
         return [response.text for response in responses]
 
      
 
-def load_model(model: str, gpus: int, mem_percent: float, sampling_params: SamplingParams = None, system_prompt: str = "You are a helpful machine translation assistant.") -> Model:    
+class DummyModel(Model):
+    """CPU stand-in for a local model that returns the last line of each input after spinning on CPU time."""
+
+    def __init__(self, model: str, gpus: int, sampling_params: SamplingParams, system_prompt: str, seconds_per_request: float = 0.002, seconds_per_token: float = 0.0001) -> None:
+        super().__init__(model, gpus, 1, sampling_params, system_prompt)
+        self.seconds_per_request = seconds_per_request
+        self.seconds_per_token = seconds_per_token
+
+    def generate(self, prompts: list[str], *, quiet: bool = False, max_tokens: list[int] | None = None) -> list[str]:
+        caps = [self.sampling_params.max_tokens for _ in prompts] if max_tokens is None else max_tokens
+        texts = []
+        for prompt, cap in zip(tqdm(prompts, disable=quiet), caps):
+            time_start = time.perf_counter()
+            cpu_start = time.process_time()
+            words = prompt.splitlines()[-1].split()[:cap] if prompt.strip() else []
+            completion_tokens = len(words) * self.sampling_params.n
+            seconds = self.seconds_per_request + self.seconds_per_token * (len(prompt.split()) + completion_tokens)
+            # CPU time, not wall time, so that processes sharing a core take correspondingly longer
+            while time.process_time() - cpu_start < seconds:
+                pass
+            self._record_request(time.perf_counter() - time_start, len(prompt.split()), completion_tokens)
+            texts.append(" ".join(words))
+        self.last_samples = [[text] * self.sampling_params.n for text in texts]
+        return texts
+
+
+def _data_parallel_worker(rank: int, devices: list[str], load_kwargs: dict, tasks, results):
+    """Load a replica of the model on `devices` and generate the chunks from `tasks` until it gets None."""
+    os.environ["CUDA_VISIBLE_DEVICES"] = ",".join(devices)
+    try:
+        model = load_model(**load_kwargs)
+        results.put(("ready", rank, None))
+        for chunk_id, prompts, max_tokens in iter(tasks.get, None):
+            stats_before = model.stats.copy()
+            count_latencies = len(model.latencies)
+            model.last_stopped_early, model.last_samples = [], []
+            texts = model.generate(prompts, quiet=True, **({} if max_tokens is None else {"max_tokens": max_tokens}))
+            results.put(("chunk", chunk_id, {
+                "texts": texts,
+                "stopped_early": model.last_stopped_early or [False for _ in texts],
+                "samples": model.last_samples or [[text] for text in texts],
+                "stats": model.stats - stats_before,
+                "latencies": model.latencies[count_latencies:],
+            }))
+    except Exception:
+        results.put(("error", rank, traceback.format_exc()))
+
+
+def _stop_workers(processes, tasks):
+    for _ in processes:
+        tasks.put(None)
+    for process in processes:
+        process.join(timeout=60)
+        if process.is_alive():
+            process.terminate()
+
+
+class DataParallelModel(Model):
+    """Replicas of a local model in `workers` processes that take chunks of the inputs, merged back in input order."""
+
+    loads_engine = False
+
+    def __init__(self, model: str, gpus: int, mem_percent: float, sampling_params: SamplingParams, system_prompt: str, enable_prefix_caching: bool = False, pretokenize: bool = False, stop_repetitions: bool = False, workers: int = 2, chunks_per_worker: int = 4):
+        super().__init__(model, gpus, mem_percent, sampling_params, system_prompt, enable_prefix_caching, pretokenize, stop_repetitions)
+        self.workers = workers
+        # more chunks than workers balance the load, fewer keep the batches of each engine big
+        self.chunks_per_worker = chunks_per_worker
+        self._tokenizer = None
+
+        visible = os.environ.get("CUDA_VISIBLE_DEVICES")
+        devices = visible.split(",") if visible else [str(i) for i in range(workers * gpus)]
+        if self.type == "vllm" and len(devices) < workers * gpus:
+            raise ValueError(f"{workers} data parallel workers with {gpus} GPUs each need {workers * gpus} devices, got {len(devices)}")
+
+        load_kwargs = {
+            "model": model, "gpus": gpus, "mem_percent": mem_percent, "sampling_params": sampling_params,
+            "system_prompt": system_prompt, "enable_prefix_caching": enable_prefix_caching,
+            "pretokenize": pretokenize, "stop_repetitions": stop_repetitions,
+        }
+        # CUDA can not be used in forked processes
+        context = multiprocessing.get_context("spawn")
+        self._tasks = context.Queue()
+        self._results = context.Queue()
+        # not daemonic, because vLLM starts processes of its own
+        self._processes = [
+            context.Process(
+                target=_data_parallel_worker,
+                args=(rank, devices[rank * gpus:(rank + 1) * gpus], load_kwargs, self._tasks, self._results),
+            )
+            for rank in range(workers)
+        ]
+        for process in self._processes:
+            process.start()
+        # stops the workers when the model is garbage collected or at exit, without keeping the model alive
+        self._finalizer = weakref.finalize(self, _stop_workers, self._processes, self._tasks)
+        for _ in range(workers):
+            self._receive()
+        print(f"Started {workers} data parallel workers for {model}")
+
+    def _receive(self):
+        while True:
+            try:
+                kind, key, value = self._results.get(timeout=10)
+            except queue.Empty:
+                dead = [process for process in self._processes if not process.is_alive()]
+                if dead:
+                    self.close()
+                    raise RuntimeError(f"Data parallel worker exited with code {dead[0].exitcode}") from None
+                continue
+            if kind == "error":
+                self.close()
+                raise RuntimeError(f"Data parallel worker {key} failed:\n{value}")
+            return kind, key, value
+
+    def close(self):
+        self._finalizer()
+
+    def get_tokenizer(self):
+        if self._tokenizer is None:
+            import transformers
+            self._tokenizer = transformers.AutoTokenizer.from_pretrained(self.model)
+        return self._tokenizer
+
+    def generate(self, prompts: list[str], *, quiet: bool = False, max_tokens: list[int] | None = None) -> list[str]:
+        size = max(math.ceil(len(prompts) / (self.workers * self.chunks_per_worker)), 1)
+        starts = range(0, len(prompts), size)
+        for chunk_id, start in enumerate(starts):
+            self._tasks.put((
+                chunk_id, prompts[start:start + size], None if max_tokens is None else list(max_tokens[start:start + size]),
+            ))
+
+        texts, self.last_stopped_early, self.last_samples = [], [], []
+        # chunks that arrived before the ones preceding them
+        chunks = {}
+        next_id = 0
+        with tqdm(total=len(prompts), disable=quiet) as progress:
+            while next_id < len(starts):
+                _, chunk_id, chunk = self._receive()
+                chunks[chunk_id] = chunk
+                self.stats += chunk["stats"]
+                self.latencies.extend(chunk["latencies"])
+                progress.update(len(chunk["texts"]))
+                # merge the chunks that are next in input order
+                while next_id in chunks:
+                    chunk = chunks.pop(next_id)
+                    texts.extend(chunk["texts"])
+                    self.last_stopped_early.extend(chunk["stopped_early"])
+                    self.last_samples.extend(chunk["samples"])
+                    next_id += 1
+        return texts
+
+
+def load_model(model: str, gpus: int, mem_percent: float, sampling_params: SamplingParams = None, system_prompt: str = "You are a helpful machine translation assistant.", enable_prefix_caching: bool = False, pretokenize: bool = False, stop_repetitions: bool = False, data_parallel: int = 1) -> Model:
     if sampling_params is None:
         sampling_params = default_sampling_params()
 
-    if "gpt" in model.lower():
+    if data_parallel > 1:
+        if get_model_type(model) not in ["vllm", "dummy"]:
+            raise ValueError(f"Data parallelism is only supported for local models, not {model}")
+        return DataParallelModel(model, gpus, mem_percent, sampling_params, system_prompt, enable_prefix_caching, pretokenize, stop_repetitions, data_parallel)
+    elif "gpt" in model.lower():
         return OpenAIModel(model, gpus, sampling_params, system_prompt)
     elif "tower" in model.lower():
-        return TowerModel(model, gpus, mem_percent, sampling_params, system_prompt)
+        return TowerModel(model, gpus, mem_percent, sampling_params, system_prompt, enable_prefix_caching, pretokenize, stop_repetitions)
     elif "euro" in model.lower() or "llama" in model.lower():
-        return EuroLLMModel(model, gpus, mem_percent, sampling_params, system_prompt)
+        return EuroLLMModel(model, gpus, mem_percent, sampling_params, system_prompt, enable_prefix_caching, pretokenize, stop_repetitions)
     elif "claude" in model.lower():
         return AnthropicModel(model, gpus, sampling_params, system_prompt)
     elif "gemini" in model.lower():
         return GeminiModel(model, gpus, sampling_params, system_prompt)
     elif "qwen" in model.lower():
-        return QwenLLMModel(model, gpus, mem_percent, sampling_params, system_prompt)
+        return QwenLLMModel(model, gpus, mem_percent, sampling_params, system_prompt, enable_prefix_caching, pretokenize, stop_repetitions)
+    elif model == "dummy":
+        return DummyModel(model, gpus, sampling_params, system_prompt)
     else:
         raise ValueError(f"Model {model} not supported")
     
-def default_sampling_params() -> SamplingParams:
+def default_sampling_params(n: int = 1, temperature: float = 0.05) -> SamplingParams:
     # TODO define reasonable values
     return SamplingParams(
-        n=1,
+        n=n,
         max_tokens=512,
-        temperature=0.05,
+        temperature=temperature,
         # stop at end of text (can trim after newlines later?)
         stop=["<|im_end|>", "<|eot_id|>"], # TODO make sure this works for all the models
         # top_p=0.9,
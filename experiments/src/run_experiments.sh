@@ -3,10 +3,12 @@
 set -x
 
 MODELS=("utter-project/EuroLLM-9B-Instruct") # "Unbabel/TowerInstruct-7B-v0.2")
-SCENARIOS=("--prompt base" "--prompt minimal" "--prompt base --perturbation orthographic" "--prompt base --perturbation typos_synthetic" "--prompt base --perturbation L2" "--prompt base --perturbation LazyUser" "--prompt base --perturbation llm" "--prompt base --perturbation lexicalphrasal" "--prompt base --perturbation register")
+SCENARIOS=("base" "minimal" "base:orthographic" "base:typos_synthetic" "base:L2" "base:LazyUser" "base:llm" "base:lexicalphrasal" "base:register")
+# shared by all jobs of the sweep, delete it to start a new sweep
+QUEUE="../work_queue/open_test"
 
-for model in "${MODELS[@]}"; do
-  for scenario in "${SCENARIOS[@]}"; do
-    python -m main --model "${model}" ${scenario} --split test --mem_percent 0.9 --gpus 1
-  done
-done
+# every job claims units (model, prompt, lp, split) from the queue until the sweep is drained, so any number of
+# jobs can run this script at once, e.g.:
+# sbatch --array=0-7 -p gpu-troja,gpu-ms --gpus=1 run_experiments.sh
+python -m work_queue --queue "${QUEUE}" --models "${MODELS[@]}" --scenarios "${SCENARIOS[@]}" --splits test \
+  --mem_percent 0.9 --gpus 1 --resume
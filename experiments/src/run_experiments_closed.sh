@@ -4,19 +4,20 @@ set -x
 MODELS=("gemini-2.0-flash-001")
 # MODELS=("gpt-4o-mini")
 # MODELS=("gemini-2.0-flash-001" "gpt-4o-mini")
-SCENARIOS=("--prompt base" "--prompt minimal" "--prompt base --perturbation orthographic" "--prompt base --perturbation llm"
-"--prompt base --perturbation L2" "--prompt base --perturbation LazyUser" "--prompt base --perturbation lexicalphrasal" "--prompt base --perturbation register" "--prompt base --perturbation typos_synthetic")
-# SCENARIOS=("--prompt base" "--prompt minimal")
+SCENARIOS=("base" "minimal" "base:orthographic" "base:llm"
+"base:L2" "base:LazyUser" "base:lexicalphrasal" "base:register" "base:typos_synthetic")
+# SCENARIOS=("base" "minimal")
 
 # SPLIT="micro_test"
 SPLIT="test"
 
+# shared by all jobs of the sweep, delete it to start a new sweep
+QUEUE="../work_queue/closed_${SPLIT}"
+
 # Output: '../output_translations/wmt24/system-outputs/{model.short}/three/{split}/noising_{perturbation}_{prompt_id}_{split}_results.jsonl'
-for model in "${MODELS[@]}"; do
-  for scenario in "${SCENARIOS[@]}"; do
-    python -m main --model "${model}" ${scenario} --split $SPLIT --mem_percent 0.9 --gpus 2
-  done
-done
+# every job claims units from the queue until the sweep is drained, so any number of jobs can run this script at once
+python -m work_queue --queue "${QUEUE}" --models "${MODELS[@]}" --scenarios "${SCENARIOS[@]}" --splits $SPLIT \
+  --mem_percent 0.9 --gpus 2 --resume
 
 
 # Evaluation
@@ -25,3 +26,4 @@ done
 
 # sbatch -J closed-models-tiny.out -p gpu-troja,gpu-ms --mem=10G --exclude=tdll-8gpu1 --constraint=gpuram48G --gpus=1 -n 1 -N 1 -c 1 run_experiments_closed.sh
 # sbatch -J closed-models-test.out --mem=10G -n 1 -N 1 -c 1 run_experiments_closed.sh
+# sbatch -J closed-models-test.out --array=0-3 --mem=10G -n 1 -N 1 -c 1 run_experiments_closed.sh
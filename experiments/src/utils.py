@@ -44,7 +44,41 @@ CHAT_OUTRO = {
 }
 
 
-def load_prompts(args):
+PLACEHOLDER_SOURCE_TEXT = "{source_text}"
+_PLACEHOLDER_RE = re.compile(r"(\{source_lang\}|\{target_lang\}|\{source_text\})")
+
+
+def compile_prompt(prompt_text):
+    """Split the prompt once into literal segments and the {source_lang}, {target_lang}, {source_text} placeholders."""
+    return [segment for segment in _PLACEHOLDER_RE.split(prompt_text) if segment]
+
+
+def render_prompt(template, data):
+    """Render a compiled prompt for every item of `data`, substituting each placeholder exactly once."""
+    chunks = {}
+    model_inputs = []
+    for item in data:
+        langs = item['langs']
+        if langs not in chunks:
+            chunks[langs] = render_chunks(template, langs)
+        model_inputs.append(item['src'].join(chunks[langs]))
+    return model_inputs
+
+
+def render_chunks(template, langs):
+    """Literal chunks of a compiled prompt for `langs` around each {source_text}, to be joined with the source text."""
+    values = {"{source_lang}": CODE_MAP[langs[:2]], "{target_lang}": CODE_MAP[langs[3:]]}
+    chunks = [""]
+    for segment in template:
+        if segment == PLACEHOLDER_SOURCE_TEXT:
+            chunks.append("")
+        else:
+            chunks[-1] += values.get(segment, segment)
+    return chunks
+
+
+def load_prompts(args, prefer=None):
+    """Load the prompts of the scenario in `args`, one sampled per bucket unless `prefer(prompt)` picks one."""
     if not args.perturbation:
         with open(f'../prompts/mt_{args.prompt}.json', 'r') as file:
             return json.load(file)
@@ -61,7 +95,8 @@ def load_prompts(args):
     final_prompts = []
     for buckets in bucketed_prompts.values():
         for bucket in buckets:
-            final_prompts.append(random.sample(bucket, 1)[0])
+            preferred = [prompt for prompt in bucket if prefer is not None and prefer(prompt)]
+            final_prompts.append(preferred[0] if preferred else random.sample(bucket, 1)[0])
 
     return final_prompts
 
@@ -137,7 +172,44 @@ def extract_translation(text):
     return translation
 
 
-def parse_arguments():
+PROMPTS = ["base", "minimal"]
+PERTURBATIONS = [None, "orthographic", "llm", "L2", "LazyUser", "lexicalphrasal", "register", "typos_synthetic"]
+
+# USD per 1M (input, output) tokens of the API models, used by `main.py --plan`; check current pricing before relying on it
+API_PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gemini-2.0-flash-001": (0.10, 0.40),
+    "claude-3-5-sonnet": (3.00, 15.00),
+    "claude-3-5-haiku": (0.80, 4.00),
+}
+
+
+def get_model_short(model):
+    """Short model name used in the output paths, e.g. EuroLLM for utter-project/EuroLLM-9B-Instruct."""
+    return model.split("/")[1].split("-")[0] if "/" in model else model.split("-")[0]
+
+
+def get_model_type(model):
+    """'vllm' for local (HF) models, 'dummy' for the CPU stand-in model, 'openai' for API models."""
+    if model == "dummy":
+        return "dummy"
+    return "vllm" if "/" in model else "openai"
+
+
+def parse_scenario(scenario):
+    """Parse PROMPT or PROMPT:PERTURBATION, e.g. `base:orthographic`, into a (prompt, perturbation) tuple."""
+    prompt, _, perturbation = scenario.partition(":")
+    perturbation = perturbation or None
+    if prompt not in PROMPTS or perturbation not in PERTURBATIONS:
+        raise argparse.ArgumentTypeError(
+            f"Invalid scenario {scenario}, expected PROMPT[:PERTURBATION] with PROMPT in {PROMPTS} "
+            f"and PERTURBATION in {PERTURBATIONS[1:]}"
+        )
+    return prompt, perturbation
+
+
+def parse_arguments(argv=None):
     parser = argparse.ArgumentParser(description=".")
     parser.add_argument(
         "--mem_percent",
@@ -171,7 +243,7 @@ def parse_arguments():
         "--prompt",
         type=str,
         default="base",
-        choices=["base", "minimal"],
+        choices=PROMPTS,
         help="'Pristine' prompt to use for generation.",
     )
     parser.add_argument(
@@ -184,16 +256,127 @@ def parse_arguments():
         "--perturbation",
         type=str,
         default=None,
-        choices=[None, "orthographic", "llm", "L2", "LazyUser", "lexicalphrasal", "register", "typos_synthetic"],
+        choices=PERTURBATIONS,
         help="Perturbation to use for generation.",
     )
+    parser.add_argument(
+        "--prompt-ids",
+        type=str,
+        nargs="+",
+        default=None,
+        help="Only run the prompts of the scenario with these ids (for bucketed perturbations, these are picked from "
+             "their buckets).",
+    )
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        help="Only print what would be generated: inputs, deduplicable inputs, prompt and completion tokens, API cost "
+             "and wall time estimated from the throughput in previous metrics files. No model is loaded.",
+    )
+    parser.add_argument(
+        "--plan-file",
+        type=str,
+        default=None,
+        help="With --plan, also write every input that would be generated to this JSONL file.",
+    )
     parser.add_argument(
         "--rerun-last",
         type=int,
         default=None,
         help="Rerun the last N experiments.",
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "--scenarios",
+        type=parse_scenario,
+        nargs="+",
+        default=None,
+        help="Run several PROMPT[:PERTURBATION] scenarios (e.g. base minimal base:L2) in one process with one loaded "
+             "model. Overrides --prompt and --perturbation.",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Skip prompts whose output file is complete and regenerate only the items missing from the "
+             "item-level checkpoints of partly done prompts.",
+    )
+    parser.add_argument(
+        "--checkpoint-every",
+        type=int,
+        default=None,
+        help="With --resume, number of items generated between checkpoints (default: 100 for API models, while local "
+             "models get all inputs in one engine call to keep their batches full).",
+    )
+    parser.add_argument(
+        "--no-dedup",
+        dest="dedup",
+        action="store_false",
+        help="Send every input to the model, even if an identical request was already generated.",
+    )
+    parser.add_argument(
+        "--prefix-order",
+        action="store_true",
+        help="Enable vLLM prefix caching and order the requests so that inputs sharing a prompt prefix are adjacent. "
+             "Reports the prefix cache hit rate.",
+    )
+    parser.add_argument(
+        "--pretokenize",
+        action="store_true",
+        help="For vLLM models, render the chat template once and submit token ids from a token cache that persists "
+             "across runs instead of letting vLLM re-tokenize every conversation.",
+    )
+    parser.add_argument(
+        "--batch-prompts",
+        action="store_true",
+        help="Submit the inputs of all prompts in a single generate call instead of one call per prompt.",
+    )
+    parser.add_argument(
+        "--stop-repetitions",
+        action="store_true",
+        help="For vLLM models, stop generations that loop (repeat the same n-gram) early and flag them with "
+             "'stopped_early' in the output. Requires vLLM >= 0.11.",
+    )
+    parser.add_argument(
+        "--data-parallel",
+        type=int,
+        default=1,
+        help="For local models that fit on --gpus devices, run N replicas in worker processes, each on its own --gpus "
+             "devices, and split the inputs between them (default: 1).",
+    )
+    parser.add_argument(
+        "--samples",
+        type=int,
+        default=1,
+        help="Generate N samples per input in one request that shares the prefill (vLLM SamplingParams.n, n of the "
+             "OpenAI API, candidate_count of Gemini) and write all of them as 'tgts'. 'tgt' is the first sample.",
+    )
+    parser.add_argument(
+        "--temperature",
+        type=float,
+        default=None,
+        help="Sampling temperature (default: 0.05). Raise it with --samples to measure the output variance.",
+    )
+    parser.add_argument(
+        "--length-budget",
+        action="store_true",
+        help="For vLLM models, cap the generated tokens of each request by the source length times the output/source "
+             "length ratio of the language pair in previous outputs, instead of the flat max_tokens. Truncated "
+             "outputs are generated again with a bigger cap.",
+    )
+    parser.add_argument(
+        "--length-budget-margin",
+        type=float,
+        default=1.25,
+        help="Safety margin of --length-budget over the predicted length (default: 1.25).",
+    )
+    parser.add_argument(
+        "--output-format",
+        type=str,
+        default="jsonl",
+        choices=["jsonl", "store"],
+        help="'jsonl' writes one denormalized file per prompt, 'store' writes normalized items, prompts and outputs "
+             "tables (see grammar_v_mtllm.utils_outputs) that take a fraction of the disk space.",
+    )
+    return parser.parse_args(argv)
 
 
 neighbours = {
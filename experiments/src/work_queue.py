@@ -0,0 +1,261 @@
+"""
+Work queue for sweeps that are drained cooperatively by many jobs (e.g. the tasks of a SLURM array) through lock
+files on a shared filesystem.
+
+The sweep is a manifest of work units (model, scenario, prompt_id, lp, split), created by whichever job starts first.
+A job claims a unit by creating its lock file exclusively, keeps the claim alive with a heartbeat (the mtime of the
+lock file) while `main.main` translates it and marks it done afterwards. Claims whose heartbeat is older than
+--stale-after (the job was killed or its node died) are reclaimed by other jobs. Failed units are retried up to
+--max-attempts times.
+
+Queue directory layout:
+    manifest.jsonl          the sweep parameters, then one unit per line
+    claims/{unit_id}.lock   claimed units, with the owner
+    done/{unit_id}.json     finished units
+    failed/{unit_id}.*      tracebacks of failed attempts
+
+Arguments that are not used by the queue are passed to main.py for every unit (e.g. --gpus, --resume).
+
+usage:
+python -m work_queue --queue ../work_queue/test --models utter-project/EuroLLM-9B-Instruct --scenarios base base:L2 --splits test --resume
+"""
+
+import argparse
+import collections
+import gc
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+import traceback
+import uuid
+from argparse import Namespace
+
+from utils import parse_arguments, parse_scenario, load_prompts
+
+
+def get_unit_id(unit):
+    return hashlib.sha1(json.dumps(unit, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def build_manifest(models, scenarios, lps, splits):
+    """All units of the sweep. Bucketed prompts are sampled once per scenario and shared by all models and pairs."""
+    from main import get_prompt_text_id
+
+    units = []
+    for prompt, perturbation in scenarios:
+        args = Namespace(prompt=prompt, perturbation=perturbation)
+        prompt_ids = list(dict.fromkeys(get_prompt_text_id(args, x)[1] for x in load_prompts(args)))
+        for model in models:
+            for lp in lps:
+                for split in splits:
+                    for prompt_id in prompt_ids:
+                        unit = {
+                            "model": model, "prompt": prompt, "perturbation": perturbation, "prompt_id": prompt_id,
+                            "lp": lp, "split": split,
+                        }
+                        units.append({"unit_id": get_unit_id(unit)} | unit)
+    # units of one model are adjacent so that jobs rarely need to load another model
+    units.sort(key=lambda unit: models.index(unit["model"]))
+    return units
+
+
+def load_or_create_manifest(queue, models, scenarios, lps, splits):
+    """Read the manifest of `queue`, creating it if this is the first job. Concurrent jobs all end up with the same one."""
+    fname = os.path.join(queue, "manifest.jsonl")
+    # as read back from the manifest, e.g. scenarios become lists
+    sweep = json.loads(json.dumps({"models": models, "scenarios": scenarios, "lps": lps, "splits": splits}))
+    for dirname in ["claims", "done", "failed"]:
+        os.makedirs(os.path.join(queue, dirname), exist_ok=True)
+    if not os.path.exists(fname):
+        units = build_manifest(models, scenarios, lps, splits)
+        fname_tmp = f"{fname}.{socket.gethostname()}.{os.getpid()}.tmp"
+        with open(fname_tmp, "w", encoding="utf-8") as f:
+            f.write("".join(json.dumps(line, ensure_ascii=False) + "\n" for line in [{"sweep": sweep}] + units))
+        try:
+            # unlike os.replace, fails if another job created the manifest in the meantime
+            os.link(fname_tmp, fname)
+        except FileExistsError:
+            pass
+        os.remove(fname_tmp)
+    with open(fname, "r", encoding="utf-8") as f:
+        header, *units = [json.loads(line) for line in f]
+    if header["sweep"] != sweep:
+        raise ValueError(
+            f"Queue {queue} was created for another sweep ({json.dumps(header['sweep'])}), "
+            "pass the same --models, --scenarios, --lps and --splits or use a new --queue"
+        )
+    return units
+
+
+class Claim:
+    """Exclusive claim of one unit, kept alive by a heartbeat thread until released."""
+
+    def __init__(self, path, owner, heartbeat):
+        self.path = path
+        self.owner = owner
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._beat, args=(heartbeat,), daemon=True)
+        self._thread.start()
+
+    def _beat(self, heartbeat):
+        while not self._stop.wait(heartbeat):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    if json.load(f)["owner"] != self.owner:
+                        raise FileNotFoundError(self.path)
+                os.utime(self.path)
+            except (FileNotFoundError, json.JSONDecodeError):
+                # reclaimed by another job because the heartbeat was late, the unit will be done twice
+                print(f"Lost claim {self.path}")
+                self.lost = True
+                return
+
+    def release(self):
+        self._stop.set()
+        self._thread.join()
+        if not self.lost:
+            os.remove(self.path)
+
+
+def try_claim(queue, unit, owner, heartbeat, stale_after):
+    """Claim `unit`, reclaiming a stale claim of another job. Returns None if the unit is taken."""
+    path = os.path.join(queue, "claims", f"{unit['unit_id']}.lock")
+    for _ in range(2):
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                age = time.time() - os.stat(path).st_mtime
+            except FileNotFoundError:
+                # released in the meantime
+                continue
+            if age < stale_after:
+                return None
+            # renaming is atomic, so only one job can take over a stale claim
+            path_stale = f"{path}.{owner}.stale"
+            try:
+                os.rename(path, path_stale)
+            except FileNotFoundError:
+                return None
+            if time.time() - os.stat(path_stale).st_mtime < stale_after:
+                # another job took over the stale claim first, give its fresh claim back
+                try:
+                    os.link(path_stale, path)
+                except FileExistsError:
+                    pass
+                os.remove(path_stale)
+                return None
+            print(f"Reclaiming unit {unit['unit_id']} (no heartbeat for {age:.0f}s)")
+            os.remove(path_stale)
+            continue
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"owner": owner, "claimed": time.time()}, f)
+        return Claim(path, owner, heartbeat)
+    return None
+
+
+def get_unit_args(unit, main_argv):
+    return parse_arguments(main_argv + [
+        "--model", unit["model"], "--prompt", unit["prompt"], "--lp", unit["lp"], "--split", unit["split"],
+        "--prompt-ids", unit["prompt_id"],
+    ] + (["--perturbation", unit["perturbation"]] if unit["perturbation"] else []))
+
+
+def list_queue(queue):
+    """Ids of the done units and number of failed attempts per unit id."""
+    done = {fname.removesuffix(".json") for fname in os.listdir(os.path.join(queue, "done"))}
+    failures = collections.Counter(fname.split(".")[0] for fname in os.listdir(os.path.join(queue, "failed")))
+    return done, failures
+
+
+def work(queue, units, main_argv, heartbeat=60, stale_after=600, max_attempts=3):
+    """Claim and run units until none is left. Returns the number of units run by this job."""
+    import main
+
+    owner = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+    model = None
+    count_run = 0
+    while True:
+        done, failures = list_queue(queue)
+        todo = [unit for unit in units if unit["unit_id"] not in done and failures[unit["unit_id"]] < max_attempts]
+        if not todo:
+            break
+        # prefer units of the loaded model
+        todo.sort(key=lambda unit: model is None or unit["model"] != model.model)
+
+        claim = None
+        for unit in todo:
+            claim = try_claim(queue, unit, owner, heartbeat, stale_after)
+            if claim is not None:
+                break
+        if claim is None:
+            # the remaining units are claimed by other jobs, wait in case any of them dies
+            time.sleep(heartbeat)
+            continue
+
+        # the unit may have been finished between listing and claiming
+        if os.path.exists(os.path.join(queue, "done", f"{unit['unit_id']}.json")):
+            claim.release()
+            continue
+
+        print(f"Unit {unit['unit_id']}: {json.dumps(unit)}")
+        time_start = time.time()
+        try:
+            args = get_unit_args(unit, main_argv)
+            if model is None or model.model != unit["model"]:
+                # free the previous model before loading the next one
+                model = None
+                gc.collect()
+                model = main.load_model_for_args(args)
+            main.main(args, model=model)
+        except Exception:
+            with open(os.path.join(queue, "failed", f"{unit['unit_id']}.{owner}.{time.time():.0f}"), "w") as f:
+                f.write(traceback.format_exc())
+            traceback.print_exc()
+        else:
+            with open(os.path.join(queue, "done", f"{unit['unit_id']}.json"), "w") as f:
+                json.dump({"owner": owner, "seconds": time.time() - time_start}, f)
+            count_run += 1
+        finally:
+            claim.release()
+
+    return count_run
+
+
+def print_status(queue, units):
+    done, failures = list_queue(queue)
+    claimed = {fname.removesuffix(".lock") for fname in os.listdir(os.path.join(queue, "claims")) if fname.endswith(".lock")}
+    unit_ids = {unit["unit_id"] for unit in units}
+    print(
+        f"{len(done & unit_ids)} of {len(units)} units done, {len(claimed - done)} claimed, "
+        f"{len((set(failures) - done) & unit_ids)} failed at least once"
+    )
+
+
+if __name__ == "__main__":
+    # no abbreviations, so that main.py arguments such as --split are passed through
+    args = argparse.ArgumentParser(description="Drain a sweep cooperatively with other jobs.", allow_abbrev=False)
+    args.add_argument("--queue", required=True, help="Queue directory on a filesystem shared by all jobs.")
+    args.add_argument("--models", nargs="+", required=True)
+    args.add_argument("--scenarios", type=parse_scenario, nargs="+", required=True)
+    args.add_argument("--lps", nargs="+", default=["three"])
+    args.add_argument("--splits", nargs="+", default=["test"])
+    args.add_argument("--heartbeat", type=float, default=60, help="Seconds between heartbeats (default: 60).")
+    args.add_argument(
+        "--stale-after", type=float, default=600,
+        help="Seconds without a heartbeat after which a claim is taken over (default: 600).",
+    )
+    args.add_argument("--max-attempts", type=int, default=3, help="Attempts per unit before giving up (default: 3).")
+    args.add_argument("--status", action="store_true", help="Only print the progress of the queue.")
+    args, main_argv = args.parse_known_args()
+
+    units = load_or_create_manifest(args.queue, args.models, args.scenarios, args.lps, args.splits)
+    if not args.status:
+        count_run = work(args.queue, units, main_argv, args.heartbeat, args.stale_after, args.max_attempts)
+        print(f"This job ran {count_run} units")
+    print_status(args.queue, units)
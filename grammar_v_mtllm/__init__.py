@@ -1,3 +1,15 @@
-# default imports
-# flake8: noqa F401
-import grammar_v_mtllm.utils
\ No newline at end of file
+# default imports are resolved lazily (PEP 562) so that `import grammar_v_mtllm` is nearly free
+# and heavy dependencies are only loaded by the submodules that need them
+import importlib
+
+_SUBMODULES = {"utils", "utils_fig", "utils_outputs", "utils_store"}
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_SUBMODULES))
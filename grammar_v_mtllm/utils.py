@@ -1,73 +1,547 @@
-import subset2evaluate.utils
+import contextlib
+from collections.abc import MutableMapping, Sequence
 
-def cache_guard(name, fnames):
+WMT24_LANGS = [
+    "cs-uk",
+    "en-cs",
+    "en-de",
+    "en-es",
+    "en-hi",
+    "en-is",
+    "en-ja",
+    "en-ru",
+    "en-uk",
+    "en-zh",
+    "ja-zh",
+]
+
+
+@contextlib.contextmanager
+def open_atomic(fname, mode="w"):
+    """Write `fname` through a temporary file that is unique across hosts and atomically replaces it when closed."""
+    import os
+    import socket
+    import uuid
+
+    os.makedirs(os.path.dirname(os.path.abspath(fname)), exist_ok=True)
+    fname_tmp = f"{fname}.{socket.gethostname()}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp"
+    try:
+        with open(fname_tmp, mode, **({} if "b" in mode else {"encoding": "utf-8"})) as f:
+            yield f
+        os.replace(fname_tmp, fname)
+    finally:
+        if os.path.exists(fname_tmp):
+            os.remove(fname_tmp)
+
+
+def cache_guard(name, fnames, max_bytes=None, workers=None):
+    """Load JSONL files `fnames` through a pickle cache in `cache/{name}.pkl` that re-parses changed files only."""
     import os
     import pickle
-    import json
 
+    fname_cache = f"cache/{name}.pkl"
     os.makedirs("cache", exist_ok=True)
-    if os.path.exists(f"cache/{name}.pkl"):
-        with open(f"cache/{name}.pkl", "rb") as f:
-            return pickle.load(f)
-        
-    data_all = [
-        [json.loads(x) for x in open(f, "r")]
-        for f in fnames
+
+    cached = {"manifest": {}, "data": {}}
+    if os.path.exists(fname_cache):
+        with open(fname_cache, "rb") as f:
+            cached_old = pickle.load(f)
+        # caches written before the manifest was introduced are just a list
+        if isinstance(cached_old, dict) and "manifest" in cached_old:
+            cached = cached_old
+
+    manifest = {}
+    data = {}
+    fnames_changed = []
+    for fname in dict.fromkeys(fnames):
+        entry = cached["manifest"].get(fname)
+        stat = os.stat(fname)
+        if entry is not None and (entry["size"], entry["mtime_ns"]) == (stat.st_size, stat.st_mtime_ns):
+            manifest[fname] = entry
+            continue
+        file_hash = _file_hash(fname)
+        if entry is not None and entry["hash"] == file_hash:
+            manifest[fname] = entry | {"mtime_ns": stat.st_mtime_ns}
+            continue
+        manifest[fname] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "hash": file_hash}
+        fnames_changed.append(fname)
+
+    for fname in manifest:
+        if fname not in fnames_changed:
+            data[fname] = cached["data"][fname]
+    data.update(zip(fnames_changed, load_jsonl_files(fnames_changed, workers=workers)))
+
+    if fnames_changed or manifest != cached["manifest"]:
+        with open_atomic(fname_cache, "wb") as f:
+            pickle.dump({"manifest": manifest, "data": data}, f)
+        if fnames_changed:
+            print(f"cache_guard({name}): parsed {len(fnames_changed)} new or changed of {len(manifest)} files")
+    else:
+        # mark as recently used
+        os.utime(fname_cache)
+    _evict_cache("cache", max_bytes, keep=fname_cache)
+
+    return [data[fname] for fname in fnames]
+
+
+def _file_hash(fname):
+    import hashlib
+
+    with open(fname, "rb") as f:
+        return hashlib.file_digest(f, "sha1").hexdigest()
+
+
+def load_jsonl_files(fnames, workers=None, chunk_bytes=16 * 1024**2):
+    """Same as `[[json.loads(x) for x in open(f)] for f in fnames]` (store partitions as rows), parsed in parallel."""
+    import os
+    import time
+    import collections
+    import concurrent.futures
+    import tqdm
+
+    tasks = [task for fname in fnames for task in _jsonl_chunks(fname, chunk_bytes)]
+    total_bytes = sum(end - start for _, start, end in tasks)
+    if workers is None:
+        # respects the CPUs allocated to a SLURM job, unlike os.cpu_count()
+        workers = min(len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count(), len(tasks))
+    time_start = time.time()
+
+    data = {fname: [] for fname in fnames}
+    progress = tqdm.tqdm(total=total_bytes, unit="B", unit_scale=True, desc="Parsing JSONL", disable=not tasks)
+
+    def collect(task, items):
+        data[task[0]].extend(items)
+        progress.update(task[2] - task[1])
+
+    if workers <= 1 or total_bytes < 4 * 1024**2:
+        for task in tasks:
+            collect(task, _parse_jsonl_chunk(task))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+            pending = collections.deque()
+            for task in tasks:
+                pending.append((task, executor.submit(_parse_jsonl_chunk, task)))
+                if len(pending) >= 2 * workers:
+                    task_done, future = pending.popleft()
+                    collect(task_done, future.result())
+            while pending:
+                task_done, future = pending.popleft()
+                collect(task_done, future.result())
+    progress.close()
+
+    time_total = time.time() - time_start
+    if tasks:
+        print(
+            f"Parsed {len(fnames)} files, {sum(len(x) for x in data.values())} lines, {total_bytes/1024**2:.1f}MB "
+            f"in {time_total:.1f}s ({total_bytes/1024**2/max(time_total, 1e-9):.1f}MB/s, {workers} workers)"
+        )
+
+    from . import utils_outputs
+
+    return [
+        utils_outputs.denormalize(fname, data[fname]) if utils_outputs.is_partition(fname) else data[fname]
+        for fname in fnames
     ]
 
-    with open(f"cache/{name}.pkl", "wb") as f:
-        pickle.dump(data_all, f)
-    
-    return data_all
 
-def load_data(split="tiny_test", langs="three"):
-    import random
-    import warnings
+def _jsonl_chunks(fname, chunk_bytes):
+    import os
+
+    size = os.path.getsize(fname)
+    chunks = []
+    start = 0
+    with open(fname, "rb") as f:
+        while start < size:
+            f.seek(min(start + chunk_bytes, size))
+            # extend the chunk to the end of the line it ends in
+            f.readline()
+            end = min(f.tell(), size)
+            chunks.append((fname, start, end))
+            start = end
+    return chunks
 
-    data = {
-        args: subset2evaluate.utils.load_data_wmt(args[0], args[1])
-        for args in [
-            ("wmt24", "cs-uk"),
-            ("wmt24", "en-cs"),
-            ("wmt24", "en-de"),
-            ("wmt24", "en-es"),
-            ("wmt24", "en-hi"),
-            ("wmt24", "en-is"),
-            ("wmt24", "en-ja"),
-            ("wmt24", "en-ru"),
-            ("wmt24", "en-uk"),
-            ("wmt24", "en-zh"),
-            ("wmt24", "ja-zh"),
-        ]
-    }
 
+def _parse_jsonl_chunk(task):
+    import json
+
+    try:
+        import orjson
+        loads_fast = orjson.loads
+    except ImportError:
+        loads_fast = json.loads
+
+    fname, start, end = task
+    with open(fname, "rb") as f:
+        f.seek(start)
+        lines = f.read(end - start).splitlines()
+
+    items = []
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            items.append(loads_fast(line))
+        except ValueError:
+            # orjson is stricter than json, e.g. about NaN
+            items.append(json.loads(line))
+    return items
+
+
+def _evict_cache(dirname, max_bytes, keep=None):
+    import os
+
+    if max_bytes is None:
+        max_bytes = int(os.environ.get("GRAMMAR_V_MTLLM_CACHE_MAX_BYTES", 10 * 1024**3))
+
+    fnames = [
+        os.path.join(dirname, fname)
+        for fname in os.listdir(dirname)
+        if fname.endswith(".pkl")
+    ]
+    stats = {fname: os.stat(fname) for fname in fnames}
+    total = sum(stat.st_size for stat in stats.values())
+    # least recently used first
+    for fname in sorted(fnames, key=lambda fname: stats[fname].st_mtime):
+        if total <= max_bytes:
+            break
+        if fname == keep:
+            continue
+        os.remove(fname)
+        total -= stats[fname].st_size
+        print(f"cache_guard: evicted {fname}")
+
+
+def cache_dir(*parts):
+    """On-disk cache shared by all jobs, moved with GRAMMAR_V_MTLLM_CACHE."""
+    import os
+
+    root = os.environ.get(
+        "GRAMMAR_V_MTLLM_CACHE",
+        os.path.join(os.path.expanduser("~"), ".cache", "grammar_v_mtllm"),
+    )
+    return os.path.join(root, *parts)
+
+
+def _resolve_langs(langs):
     if langs == "three":
-        data = {
-            ("wmt24", langs): data[("wmt24", langs)]
-            for langs in ["cs-uk", "en-de", "en-zh"]
+        return ["cs-uk", "en-de", "en-zh"]
+    elif langs == "all":
+        return list(WMT24_LANGS)
+    elif langs not in WMT24_LANGS:
+        raise ValueError(f"Language pair {langs} not found in WMT24")
+    return [langs]
+
+
+def _load_lp(langs, year="wmt24"):
+    import os
+    import pickle
+    import subset2evaluate.utils
+
+    # per-pair snapshot so that a single-pair job does not pay for loading the whole of WMT
+    fname = cache_dir(year, f"{langs}.pkl")
+    if os.path.exists(fname):
+        with open(fname, "rb") as f:
+            return pickle.load(f)
+
+    data = subset2evaluate.utils.load_data_wmt(year, langs)
+
+    # concurrent jobs never read a partial snapshot
+    with open_atomic(fname, "wb") as f:
+        pickle.dump(data, f)
+
+    return data
+
+
+SPLIT_SIZES = {
+    "micro_test": 10,
+    "tiny_test": 100,
+    "test": 500,
+    "all": None,
+}
+# string columns kept in the pair store; original values of Segment.FIELDS that the columns do not reproduce are kept
+# as JSON in "fields", everything else from the original item as JSON in "extra"
+STORE_COLUMNS = ["src", "ref", "domain", "doc"]
+
+
+def _split_size(split):
+    """Number of items in `split`, a name from SPLIT_SIZES or a number."""
+    import warnings
+
+    if split in SPLIT_SIZES:
+        if split == "all":
+            warnings.warn("Using all data which is not aligned with any of the experiments.")
+        return SPLIT_SIZES[split]
+    if isinstance(split, int) or (isinstance(split, str) and split.isdigit()):
+        return int(split)
+    raise ValueError(f"Unknown split {split}")
+
+
+def _pair_store(langs, year="wmt24"):
+    """All items of the pair in the order of one fixed permutation, so that every split is a prefix."""
+    import os
+    import json
+    import random
+    import grammar_v_mtllm.utils_store
+
+    fname = cache_dir(year, langs, "shuffled.v2.store")
+    if not os.path.exists(fname):
+        data = _load_lp(langs, year)
+        order = list(range(len(data)))
+        random.Random(0).shuffle(order)
+
+        columns = {
+            key: [data[i][key] if isinstance(data[i].get(key), str) else "" for i in order]
+            for key in STORE_COLUMNS
         }
-    elif langs != "all":
-        if ("wmt24", langs) not in data:
-            raise ValueError(f"Language pair {langs} not found in WMT24")
-        data = {("wmt24", langs): data[("wmt24", langs)]}
-
-    for k in data:
-        random.Random(0).shuffle(data[k])
-
-    if split == "micro_test":
-        sample_size = 10
-    elif split == "tiny_test":
-        sample_size = 100
-    elif split == "test":
-        sample_size = 500
-    elif split == "all":
-        sample_size = None
-        warnings.warn("Using all data which is not aligned with any of the experiments.")
-    
-    data_new = []
-    for k in data:
-        for line in data[k]:
-            line["langs"] = k[1]
-        data_new += data[k][:sample_size]
-
-    return data_new
\ No newline at end of file
+        # the upstream segment index (the position in the WMT data if there is none), never the permutation index
+        columns["src_i"] = [data[i]["src_i"] if isinstance(data[i].get("src_i"), int) else i for i in order]
+        wmt = 2000 + int(year.removeprefix("wmt"))
+        columns["fields"] = []
+        for j, i in enumerate(order):
+            decoded = {key: columns[key][j] for key in STORE_COLUMNS + ["src_i"]} | {"tgts": [], "wmt": wmt}
+            columns["fields"].append(json.dumps({
+                k: v for k, v in data[i].items() if k in decoded and v != decoded[k]
+            }, ensure_ascii=False))
+        columns["extra"] = [
+            json.dumps({k: v for k, v in data[i].items() if k not in Segment.FIELDS}, ensure_ascii=False)
+            for i in order
+        ]
+        grammar_v_mtllm.utils_store.write_store(fname, columns, meta={"langs": langs, "year": year})
+
+    return grammar_v_mtllm.utils_store.ColumnStore(fname)
+
+
+class _StoreItems(Sequence):
+    """Items of one pair store, decoded on first access and shared within the process."""
+
+    def __init__(self, store):
+        self.store = store
+        self._items = [None] * len(store)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __getitem__(self, i):
+        if self._items[i] is None:
+            self._items[i] = _decode_item(self.store, i)
+        return self._items[i]
+
+
+class SplitView(Sequence):
+    """Items over prefixes of pair stores, copied on first access so that callers can mutate them."""
+
+    def __init__(self, sources, sizes):
+        self._sources = sources
+        self._starts = [0]
+        for size in sizes:
+            self._starts.append(self._starts[-1] + size)
+        self._items = [None] * self._starts[-1]
+
+    def __len__(self):
+        return len(self._items)
+
+    def __getitem__(self, i):
+        import bisect
+
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if self._items[i] is None:
+            source_i = bisect.bisect_right(self._starts, i) - 1
+            self._items[i] = self._sources[source_i][i - self._starts[source_i]].copy()
+        return self._items[i]
+
+
+class Segment(MutableMapping):
+    """Compact dict-like record of one segment, extra fields are decoded on first access."""
+
+    FIELDS = ("src", "ref", "tgts", "langs", "wmt", "src_i", "domain", "doc")
+    __slots__ = FIELDS + ("_extra", "_extra_json")
+
+    def __init__(self, src, ref, langs, wmt, src_i, domain, doc, tgts=None, extra=None, extra_json="{}"):
+        import sys
+
+        self.src = src
+        self.ref = ref
+        self.tgts = [] if tgts is None else tgts
+        self.langs = sys.intern(langs)
+        self.wmt = wmt
+        self.src_i = src_i
+        self.domain = sys.intern(domain) if isinstance(domain, str) else domain
+        self.doc = sys.intern(doc) if isinstance(doc, str) else doc
+        self._extra = extra
+        self._extra_json = extra_json
+
+    def _extras(self):
+        import json
+
+        if self._extra is None:
+            self._extra = json.loads(self._extra_json)
+            self._extra_json = None
+        return self._extra
+
+    def __getitem__(self, key):
+        if key in self.FIELDS:
+            return getattr(self, key)
+        return self._extras()[key]
+
+    def __setitem__(self, key, value):
+        if key in self.FIELDS:
+            setattr(self, key, value)
+        else:
+            self._extras()[key] = value
+
+    def __delitem__(self, key):
+        if key in self.FIELDS:
+            raise KeyError(f"Field {key} can not be removed from a segment")
+        del self._extras()[key]
+
+    def __contains__(self, key):
+        return key in self.FIELDS or key in self._extras()
+
+    def __iter__(self):
+        yield from self.FIELDS
+        yield from self._extras()
+
+    def __len__(self):
+        return len(self.FIELDS) + len(self._extras())
+
+    def __repr__(self):
+        return f"Segment({self.to_dict()!r})"
+
+    def copy(self):
+        """Copy that shares nothing mutable with this segment."""
+        import copy
+
+        return Segment(
+            self.src, self.ref, self.langs, self.wmt, self.src_i, self.domain, self.doc,
+            tgts=copy.deepcopy(self.tgts),
+            extra=None if self._extra is None else copy.deepcopy(self._extra),
+            extra_json=self._extra_json,
+        )
+
+    def to_dict(self):
+        return dict(self.items())
+
+
+def _decode_item(store, j):
+    import json
+
+    item = Segment(
+        src=store.get("src", j),
+        ref=store.get("ref", j),
+        langs=store.meta["langs"],
+        wmt=2000 + int(store.meta["year"].removeprefix("wmt")),
+        src_i=store.get("src_i", j),
+        domain=store.get("domain", j),
+        doc=store.get("doc", j),
+        extra_json=store.get("extra", j),
+    )
+    # original values that the columns can not hold, e.g. non-string domains or non-empty tgts
+    fields = store.get("fields", j)
+    if fields != "{}":
+        for key, value in json.loads(fields).items():
+            setattr(item, key, value)
+    return item
+
+
+# pair -> _StoreItems, shared by all load_data calls in this process
+_LOADED = {}
+
+
+def load_data(split="tiny_test", langs="three"):
+    """Load the shuffled `split` (see SPLIT_SIZES, or a number of items) of `langs` (a WMT24 pair, "three" or "all")."""
+    sample_size = _split_size(split)
+
+    lps = _resolve_langs(langs)
+    for lp in lps:
+        if lp not in _LOADED:
+            _LOADED[lp] = _StoreItems(_pair_store(lp))
+
+    return SplitView(
+        [_LOADED[lp] for lp in lps],
+        [len(_LOADED[lp]) if sample_size is None else min(sample_size, len(_LOADED[lp])) for lp in lps],
+    )
+
+
+def clear_loaded_data():
+    _LOADED.clear()
+
+
+def iter_data(split="tiny_test", langs="three", batch_size=100):
+    """Batches of at most `batch_size` items in the order of `load_data`."""
+    if batch_size < 1:
+        raise ValueError("batch_size must be positive")
+    sample_size = _split_size(split)
+    lps = _resolve_langs(langs)
+
+    batch = []
+    for lp in lps:
+        store = _pair_store(lp)
+        for j in range(len(store) if sample_size is None else min(sample_size, len(store))):
+            batch.append(_decode_item(store, j))
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+# tokenizers of the models we run, by family
+TOKENIZERS = {
+    "EuroLLM": "utter-project/EuroLLM-9B-Instruct",
+    "Tower": "Unbabel/TowerInstruct-7B-v0.2",
+    "Llama": "meta-llama/Meta-Llama-3.1-8B-Instruct",
+    "Qwen": "Qwen/Qwen2.5-7B-Instruct",
+}
+
+
+def _pair_stats(langs, tokenizer=None, year="wmt24"):
+    """Per-item character counts of the pair, or token counts for `tokenizer`."""
+    import os
+    import grammar_v_mtllm.utils_store
+
+    name = "chars" if tokenizer is None else tokenizer.replace("/", "--")
+    fname = cache_dir(year, langs, f"stats.{name}.store")
+    if not os.path.exists(fname):
+        store = _pair_store(langs, year)
+        src = store.column("src")[:]
+        ref = store.column("ref")[:]
+        if tokenizer is None:
+            columns = {
+                "src_chars": [len(x) for x in src],
+                "ref_chars": [len(x) for x in ref],
+            }
+        else:
+            import transformers
+
+            tok = transformers.AutoTokenizer.from_pretrained(TOKENIZERS.get(tokenizer, tokenizer))
+            columns = {
+                "src_tokens": [len(x) for x in tok(src, add_special_tokens=False)["input_ids"]],
+                "ref_tokens": [len(x) for x in tok(ref, add_special_tokens=False)["input_ids"]],
+            }
+        grammar_v_mtllm.utils_store.write_store(fname, columns, meta={"langs": langs, "year": year, "tokenizer": tokenizer})
+
+    return grammar_v_mtllm.utils_store.ColumnStore(fname)
+
+
+def load_stats(split="tiny_test", langs="three", tokenizers=()):
+    """Per-item source and reference lengths aligned with `load_data(split, langs)`, in tokens only for `tokenizers`."""
+    sample_size = _split_size(split)
+
+    stats = []
+    for lp in _resolve_langs(langs):
+        store = _pair_store(lp)
+        chars = _pair_stats(lp)
+        tokens = {tokenizer: _pair_stats(lp, tokenizer) for tokenizer in tokenizers}
+        for j in range(len(store) if sample_size is None else min(sample_size, len(store))):
+            stats.append({
+                "langs": lp,
+                "src_i": store.get("src_i", j),
+                "src_chars": chars.get("src_chars", j),
+                "ref_chars": chars.get("ref_chars", j),
+                "src_tokens": {tokenizer: store_tok.get("src_tokens", j) for tokenizer, store_tok in tokens.items()},
+                "ref_tokens": {tokenizer: store_tok.get("ref_tokens", j) for tokenizer, store_tok in tokens.items()},
+            })
+    return stats
@@ -1,7 +1,3 @@
-import matplotlib as mpl
-import matplotlib.pyplot as plt
-
-
 COLORS = [
     "#bc272d",  # red
     "#50ad9f",  # green
@@ -33,13 +29,18 @@ NOISER_TO_NAME = {
     "noising_lexicalphrasal": "Lexicophrasal",
 }
 
-mpl.rcParams["font.family"] = "serif"
-mpl.rcParams["axes.prop_cycle"] = plt.cycler(color=COLORS)
-mpl.rcParams["legend.fancybox"] = False
-mpl.rcParams["legend.edgecolor"] = "None"
-mpl.rcParams["legend.fontsize"] = 9
-mpl.rcParams["legend.borderpad"] = 0.1
 
+# importing this module does not touch matplotlib, plotting scripts call this explicitly
+def set_style():
+    import matplotlib as mpl
+    import matplotlib.pyplot as plt
+
+    mpl.rcParams["font.family"] = "serif"
+    mpl.rcParams["axes.prop_cycle"] = plt.cycler(color=COLORS)
+    mpl.rcParams["legend.fancybox"] = False
+    mpl.rcParams["legend.edgecolor"] = "None"
+    mpl.rcParams["legend.fontsize"] = 9
+    mpl.rcParams["legend.borderpad"] = 0.1
 
 
 def turn_off_spines(which=['top', 'right'], ax=None):
@@ -0,0 +1,176 @@
+"""
+Normalized store for translation outputs.
+
+The denormalized format has one JSONL file per prompt that repeats the source, reference, prompt and model input on
+every line. A store directory instead holds three tables:
+
+    items.jsonl                 item_id, langs, src, ref; one line per segment, shared by all prompts
+    prompts/{prompt_key}.json   prompt_id, bucket_id, prompt, prompt_src, prompt_p, prompt_noiser and, for each language
+                                pair, the literal chunks of the model input around the source text
+    outputs/{prompt_key}.jsonl  item_id, model, tgt and per-output fields such as evaluation scores
+
+The prompt and output tables are partitioned by prompt so that every prompt is written atomically and independently
+of the others. An outputs partition is read back as the rows of the denormalized format by `read_outputs`.
+"""
+
+import json
+import os
+from collections.abc import MutableMapping
+
+from grammar_v_mtllm.utils import open_atomic
+
+ITEM_FIELDS = ("src", "ref", "langs")
+PROMPT_FIELDS = ("prompt_src", "prompt", "prompt_p", "prompt_noiser", "bucket_id", "prompt_id")
+# field order of the denormalized rows
+ROW_FIELDS = (
+    "src", "ref", "langs", "model", "prompt_src", "model_input", "prompt", "prompt_p", "prompt_noiser", "bucket_id",
+    "prompt_id", "tgt",
+)
+
+
+def get_item_id(item):
+    return f"{item['langs']}:{item['src_i']}"
+
+
+def get_store_dir(fname):
+    """Store directory of the outputs partition `fname`."""
+    return os.path.dirname(os.path.dirname(os.path.abspath(fname)))
+
+
+def get_prompt_key(fname):
+    return os.path.basename(fname).removesuffix(".jsonl")
+
+
+def is_partition(fname):
+    """Whether `fname` is an outputs partition of a store (as opposed to a denormalized JSONL file)."""
+    return (
+        os.path.basename(os.path.dirname(os.path.abspath(fname))) == "outputs"
+        and os.path.exists(os.path.join(get_store_dir(fname), "items.jsonl"))
+    )
+
+
+def _write_atomic(fname, text):
+    with open_atomic(fname) as f:
+        f.write(text)
+
+
+def write_items(dirname, items):
+    """Add `items` (dicts with item_id and ITEM_FIELDS) to the items table, which is only rewritten if any are new."""
+    fname = os.path.join(dirname, "items.jsonl")
+    table = dict(_load_items(fname)) if os.path.exists(fname) else {}
+    new = [item for item in items if item["item_id"] not in table]
+    if not new:
+        return
+    for item in new:
+        table[item["item_id"]] = {"item_id": item["item_id"]} | {key: item[key] for key in ITEM_FIELDS}
+    _write_atomic(fname, "".join(json.dumps(item, ensure_ascii=False) + "\n" for item in table.values()))
+
+
+def write_prompt(dirname, prompt_key, prompt):
+    """Write the prompts table row of `prompt_key` (PROMPT_FIELDS and `input_chunks`: langs -> list of str)."""
+    _write_atomic(
+        os.path.join(dirname, "prompts", f"{prompt_key}.json"),
+        json.dumps({"prompt_key": prompt_key} | prompt, ensure_ascii=False),
+    )
+
+
+def write_outputs(fname, rows):
+    """
+    Write the outputs partition `fname` from denormalized `rows` with an `item_id`.
+    Only the fields that are not stored in the items and prompts tables are kept.
+    """
+    dropped = set(ITEM_FIELDS) | set(PROMPT_FIELDS) | {"model_input", "item_id"}
+    _write_atomic(fname, "".join(
+        json.dumps(
+            {"item_id": row["item_id"]} | {key: value for key, value in row.items() if key not in dropped},
+            ensure_ascii=False,
+        ) + "\n"
+        for row in rows
+    ))
+
+
+def copy_tables(fname, fname_out):
+    """Copy the items and prompts table rows needed by the partition `fname` to the store of `fname_out`."""
+    dirname, dirname_out = get_store_dir(fname), get_store_dir(fname_out)
+    write_items(dirname_out, _load_items(os.path.join(dirname, "items.jsonl")).values())
+    prompt = _load_prompt(dirname, get_prompt_key(fname))
+    write_prompt(dirname_out, get_prompt_key(fname_out), {key: value for key, value in prompt.items() if key != "prompt_key"})
+
+
+# (fname, size, mtime_ns) -> parsed table, shared by all partitions of a store
+_TABLES = {}
+
+
+def _load_table(fname, parse):
+    stat = os.stat(fname)
+    key = (os.path.abspath(fname), stat.st_size, stat.st_mtime_ns)
+    if key not in _TABLES:
+        with open(fname, "r", encoding="utf-8") as f:
+            _TABLES[key] = parse(f)
+    return _TABLES[key]
+
+
+def _load_items(fname):
+    return _load_table(fname, lambda f: {item["item_id"]: item for item in map(json.loads, f)})
+
+
+def _load_prompt(dirname, prompt_key):
+    return _load_table(os.path.join(dirname, "prompts", f"{prompt_key}.json"), json.load)
+
+
+class OutputRow(MutableMapping):
+    """Dict-like denormalized row of an outputs partition, sharing the item and prompt fields with the tables."""
+
+    __slots__ = ("_item", "_prompt", "_output")
+
+    def __init__(self, item, prompt, output):
+        self._item = item
+        self._prompt = prompt
+        self._output = output
+
+    def __getitem__(self, key):
+        if key in self._output:
+            return self._output[key]
+        if key in ITEM_FIELDS:
+            return self._item[key]
+        if key in PROMPT_FIELDS:
+            return self._prompt[key]
+        if key == "model_input":
+            return self._item["src"].join(self._prompt["input_chunks"][self._item["langs"]])
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        self._output[key] = value
+
+    def __delitem__(self, key):
+        if key not in self._output:
+            raise KeyError(f"Field {key} of a store row can not be removed")
+        del self._output[key]
+
+    def __contains__(self, key):
+        return key in self._output or key in ITEM_FIELDS or key in PROMPT_FIELDS or key == "model_input"
+
+    def __iter__(self):
+        yield from (key for key in ROW_FIELDS if key in self)
+        yield from (key for key in self._output if key not in ROW_FIELDS)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"OutputRow({dict(self)!r})"
+
+
+def denormalize(fname, outputs):
+    """Join the `outputs` rows of the partition `fname` with the items and prompts tables into `OutputRow`s."""
+    dirname = get_store_dir(fname)
+    items = _load_items(os.path.join(dirname, "items.jsonl"))
+    prompt = _load_prompt(dirname, get_prompt_key(fname))
+    return [OutputRow(items[output["item_id"]], prompt, output) for output in outputs]
+
+
+def read_outputs(fname):
+    """Rows of a denormalized JSONL file or of a store partition in the denormalized format."""
+    with open(fname, "r", encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    return denormalize(fname, rows) if is_partition(fname) else rows
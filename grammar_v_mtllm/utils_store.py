@@ -0,0 +1,136 @@
+"""
+Read-only columnar store backed by a memory-mapped file.
+
+Each string column is kept as one UTF-8 blob together with an array of offsets, each integer column as a flat array.
+Opening a store only maps the file, so concurrent processes on one node share the same page cache and nothing is
+decoded until a value is accessed.
+
+Layout: MAGIC, 8-byte header length, JSON header, then the column buffers, each aligned to 8 bytes.
+"""
+
+import array
+import json
+import mmap
+import os
+from collections.abc import Sequence
+
+from grammar_v_mtllm.utils import open_atomic
+
+MAGIC = b"GVMSTORE1\n"
+
+
+def write_store(fname, columns, meta=None):
+    """Write `columns` (name -> equally long lists of str or int) to `fname` atomically."""
+    lengths = {len(values) for values in columns.values()}
+    if len(lengths) > 1:
+        raise ValueError(f"Columns have different lengths: {lengths}")
+    n = lengths.pop() if lengths else 0
+
+    buffers = []
+    header = {"n": n, "meta": meta or {}, "columns": {}}
+    for name, values in columns.items():
+        if all(isinstance(x, int) for x in values):
+            header["columns"][name] = {"type": "int", "data": len(buffers)}
+            buffers.append(array.array("q", values).tobytes())
+        else:
+            encoded = [x.encode("utf-8") for x in values]
+            offsets = array.array("Q", [0])
+            for x in encoded:
+                offsets.append(offsets[-1] + len(x))
+            header["columns"][name] = {"type": "str", "offsets": len(buffers), "data": len(buffers) + 1}
+            buffers.append(offsets.tobytes())
+            buffers.append(b"".join(encoded))
+
+    # resolve buffer indices to (offset, size) relative to the aligned start of the data section
+    positions = []
+    position = 0
+    for buffer in buffers:
+        positions.append((position, len(buffer)))
+        position = _align(position + len(buffer))
+    for column in header["columns"].values():
+        for key in ["offsets", "data"]:
+            if key in column:
+                column[key] = positions[column[key]]
+    header_bytes = json.dumps(header).encode("utf-8")
+    base = _align(len(MAGIC) + 8 + len(header_bytes))
+
+    with open_atomic(fname, "wb") as f:
+        f.write(MAGIC)
+        f.write(len(header_bytes).to_bytes(8, "little"))
+        f.write(header_bytes)
+        for (start, _), buffer in zip(positions, buffers):
+            f.write(b"\0" * (base + start - f.tell()))
+            f.write(buffer)
+
+
+def _align(position, alignment=8):
+    return (position + alignment - 1) // alignment * alignment
+
+
+class ColumnStore:
+    def __init__(self, fname):
+        self.fname = fname
+        with open(fname, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                raise ValueError(f"Empty store {fname}")
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{fname} is not a column store")
+        header_len = int.from_bytes(self._mm[len(MAGIC):len(MAGIC) + 8], "little")
+        header = json.loads(self._mm[len(MAGIC) + 8:len(MAGIC) + 8 + header_len])
+        base = _align(len(MAGIC) + 8 + header_len)
+        self.n = header["n"]
+        self.meta = header["meta"]
+
+        view = memoryview(self._mm)
+        self._columns = {}
+        for name, column in header["columns"].items():
+            start, size = column["data"]
+            start += base
+            if column["type"] == "int":
+                self._columns[name] = view[start:start + size].cast("q")
+            else:
+                offsets_start, offsets_size = column["offsets"]
+                offsets_start += base
+                self._columns[name] = (
+                    view[offsets_start:offsets_start + offsets_size].cast("Q"),
+                    view[start:start + size],
+                )
+
+    def __len__(self):
+        return self.n
+
+    @property
+    def columns(self):
+        return list(self._columns.keys())
+
+    def get(self, name, i):
+        column = self._columns[name]
+        if isinstance(column, tuple):
+            offsets, data = column
+            return str(data[offsets[i]:offsets[i + 1]], "utf-8")
+        return column[i]
+
+    def column(self, name):
+        return Column(self, name)
+
+
+class Column(Sequence):
+    """Lazy view of one column; values are decoded on access."""
+
+    def __init__(self, store, name):
+        self._store = store
+        self._name = name
+
+    def __len__(self):
+        return len(self._store)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._store.get(self._name, j) for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self._store.get(self._name, i)